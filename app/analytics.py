@@ -0,0 +1,132 @@
+import numpy as np
+from app.settings import STATS_MIN_REPORTS
+from app.stats_pool import run_cpu_bound
+
+
+def pack_reports(grouped: dict[int, list[tuple]]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Опросы по КПП в плоские массивы: id КПП, ожидание, пропускная способность и смещения сегментов."""
+    ids = np.fromiter(grouped.keys(), dtype=np.int64, count=len(grouped))
+    counts = np.fromiter((len(rows) for rows in grouped.values()), dtype=np.int64, count=len(grouped))
+    offsets = np.zeros(len(grouped) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    total = int(offsets[-1])
+    wait = np.fromiter((row[0] for rows in grouped.values() for row in rows), dtype=np.float64, count=total)
+    throughput = np.fromiter((row[1] for rows in grouped.values() for row in rows), dtype=np.float64, count=total)
+    return ids, wait, throughput, offsets
+
+
+def main_cluster_stats(wait: np.ndarray, throughput: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Точное разбиение на два кластера по времени ожидания сразу для всех КПП.
+
+    В одном измерении оптимальные 2-means — это разрез отсортированных значений на две части.
+    Для каждого возможного разреза межкластерный разброс n_l * n_r * (mean_l - mean_r)^2
+    считается по префиксным суммам, лучший разрез — максимум по сегменту. Основной кластер —
+    больший по числу опросов (при равенстве — с меньшим ожиданием); одинаковые значения
+    не разделяются, поэтому сегмент из равных значений — один кластер.
+
+    Возвращает (среднее ожидание, средняя очередь = mean(ожидание * пропускная способность))
+    по основному кластеру; для КПП с числом опросов меньше STATS_MIN_REPORTS — NaN.
+    Пропускная способность может быть NaN (проезды по пингам): очередь считается по известным.
+    """
+    segments = len(offsets) - 1
+    avg_wait = np.full(segments, np.nan)
+    avg_queue = np.full(segments, np.nan)
+
+    counts = np.diff(offsets)
+    eligible = np.flatnonzero(counts >= STATS_MIN_REPORTS)
+    if not len(eligible):
+        return avg_wait, avg_queue
+
+    # Плоский массив только из подходящих сегментов
+    starts_src = offsets[eligible]
+    lengths = counts[eligible]
+    starts = np.zeros(len(eligible), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    ends = starts + lengths
+    take = np.repeat(starts_src - starts, lengths) + np.arange(int(lengths.sum()))
+    segment = np.repeat(np.arange(len(eligible)), lengths)
+
+    order = np.lexsort((wait[take], segment))
+    xs = wait[take][order]
+    # Проезды, размеченные по пингам, приходят без пропускной способности (NaN):
+    # они участвуют в разбиении по ожиданию, но не в средней очереди
+    tp = throughput[take][order]
+    known = ~np.isnan(tp)
+    queue = np.where(known, xs * tp, 0.0)
+
+    prefix = np.concatenate(([0.0], np.cumsum(xs)))
+
+    # Разрез в позиции i: слева xs[start:i], справа xs[i:end]
+    pos = np.arange(len(xs))
+    seg_start = starts[segment]
+    seg_end = ends[segment]
+    left_n = pos - seg_start
+    right_n = seg_end - pos
+    valid = left_n > 0
+    valid[1:] &= xs[:-1] < xs[1:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left_mean = (prefix[pos] - prefix[seg_start]) / left_n
+        right_mean = (prefix[seg_end] - prefix[pos]) / right_n
+        score = left_n * right_n * (left_mean - right_mean) ** 2
+    score[~valid] = -np.inf
+
+    best_score = np.maximum.reduceat(score, starts)
+    # Первая позиция с максимумом в каждом сегменте
+    hit = np.flatnonzero(valid & (score == best_score[segment]))
+    _, first = np.unique(segment[hit], return_index=True)
+    split = np.full(len(eligible), -1, dtype=np.int64)
+    split[segment[hit[first]]] = hit[first]
+
+    # Без допустимого разреза (все значения равны) весь сегмент — один кластер
+    no_split = split < 0
+    split[no_split] = ends[no_split]
+    left_main = (split - starts) >= (ends - split)
+    lo = np.where(left_main, starts, split)
+    hi = np.where(left_main, split, ends)
+
+    # Итоговые средние — суммой по срезу, а не разностью глобальных префиксов,
+    # чтобы ошибка не накапливалась по всем предыдущим КПП
+    bounds = np.column_stack((lo, hi)).ravel()
+    size = hi - lo
+    avg_wait[eligible] = np.round(np.add.reduceat(np.append(xs, 0.0), bounds)[::2] / size, 2)
+    queue_sum = np.add.reduceat(np.append(queue, 0.0), bounds)[::2]
+    queue_n = np.add.reduceat(np.append(known, 0), bounds)[::2]
+    # Если в основном кластере нет опросов с пропускной способностью — среднее по всему КПП, иначе 0
+    seg_queue_sum = np.add.reduceat(queue, starts)
+    seg_queue_n = np.add.reduceat(known.astype(np.int64), starts)
+    queue_sum = np.where(queue_n > 0, queue_sum, seg_queue_sum)
+    queue_n = np.where(queue_n > 0, queue_n, seg_queue_n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_queue[eligible] = np.where(queue_n > 0, np.rint(queue_sum / queue_n), 0.0)
+    return avg_wait, avg_queue
+
+
+def grouped_cluster_stats(grouped: dict[int, list[tuple]]) -> dict[int, tuple[float, int]]:
+    """(среднее ожидание, средняя очередь) по КПП, у которых хватает опросов."""
+    if not grouped:
+        return {}
+    ids, wait, throughput, offsets = pack_reports(grouped)
+    return _by_checkpoint(ids, *main_cluster_stats(wait, throughput, offsets))
+
+
+async def compute_cluster_stats(grouped: dict[int, list[tuple]]) -> dict[int, tuple[float, int]]:
+    """То же, что grouped_cluster_stats, но расчёт идёт вне event loop.
+
+    В пул процессов уходят только плоские массивы numpy (каждый сериализуется одним буфером),
+    обратно — два массива результатов.
+    """
+    if not grouped:
+        return {}
+    ids, wait, throughput, offsets = pack_reports(grouped)
+    avg_wait, avg_queue = await run_cpu_bound(main_cluster_stats, wait, throughput, offsets)
+    return _by_checkpoint(ids, avg_wait, avg_queue)
+
+
+def _by_checkpoint(ids: np.ndarray, avg_wait: np.ndarray, avg_queue: np.ndarray) -> dict[int, tuple[float, int]]:
+    return {
+        int(cp_id): (float(w), int(q))
+        for cp_id, w, q in zip(ids, avg_wait, avg_queue)
+        if not np.isnan(w)
+    }
@@ -7,3 +7,17 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "border_db")
 
 DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+CHECKPOINT_SNAPSHOT_ENABLED = os.getenv("CHECKPOINT_SNAPSHOT_ENABLED", "1") == "1"
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_JOB_SAMPLE_RATE = float(os.getenv("PROFILE_JOB_SAMPLE_RATE", "0"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "profiles")
+
+# upgrade — воркеры применяют миграции под advisory lock; check — только сверка ревизий; off — пропуск
+MIGRATION_MODE = os.getenv("MIGRATION_MODE", "upgrade")
+
+# Процессы для расчёта кластеров статистики; 0 — расчёт в потоке внутри воркера
+STATS_WORKER_PROCESSES = int(os.getenv("STATS_WORKER_PROCESSES", "1"))
@@ -0,0 +1,205 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db import AsyncSessionLocal
+from app.models import Checkpoint, JobStatus, LocationPing, ObservedCrossing
+from app.polyline import haversine_km
+from app.settings import (
+    LOCATION_ENTRY_TTL, STATS_WATERMARK_LAG, CROSSING_APPROACH_KM, CROSSING_DWELL_KM, CROSSING_EXIT_KM,
+    CROSSING_SESSION_TIMEOUT, CROSSING_MAX_DURATION, CROSSING_MAX_SESSIONS, CROSSING_READ_CHUNK
+)
+from app.snapshot import get_snapshot
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+CROSSINGS_JOB = "detect_crossings"
+
+
+class PingSession:
+    """Проезд одного устройства через один КПП.
+
+    Подъезд — устройство ближе CROSSING_APPROACH_KM; у поста — ближе CROSSING_DWELL_KM
+    (dwell_until — последний такой пинг); выезд — после поста дальше CROSSING_EXIT_KM.
+    Время проезда — от первого пинга подъезда до последнего пинга у поста.
+    """
+
+    __slots__ = ("started_at", "last_seen", "dwell_until")
+
+    def __init__(self, started_at: datetime):
+        self.started_at = started_at
+        self.last_seen = started_at
+        self.dwell_until: datetime | None = None
+
+
+class Sessionizer:
+    """Потоковая разметка пингов на проезды с ограниченным состоянием.
+
+    Сессии лежат в OrderedDict в порядке последнего пинга: просроченные снимаются с начала,
+    при переполнении CROSSING_MAX_SESSIONS вытесняются самые давно молчащие.
+    """
+
+    def __init__(self):
+        self.sessions: OrderedDict[tuple[str, int], PingSession] = OrderedDict()
+        self.until: datetime | None = None
+        self.evicted = 0
+
+    def reset(self):
+        self.sessions.clear()
+        self.until = None
+
+    def feed(self, device_id: str, checkpoint_id: int, ts: datetime, distance_km: float) -> tuple | None:
+        """Обрабатывает пинг; возвращает (device_id, checkpoint_id, started_at, finished_at) завершённого проезда."""
+        key = (device_id, checkpoint_id)
+        session = self.sessions.get(key)
+        if session is not None and (
+            ts - session.last_seen > CROSSING_SESSION_TIMEOUT or ts - session.started_at > CROSSING_MAX_DURATION
+        ):
+            del self.sessions[key]
+            session = None
+
+        if session is None:
+            # Сессия открывается только на подъезде: у поста без подъезда начало очереди неизвестно
+            if CROSSING_DWELL_KM < distance_km <= CROSSING_APPROACH_KM:
+                self.sessions[key] = PingSession(ts)
+                if len(self.sessions) > CROSSING_MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+                    self.evicted += 1
+            return None
+
+        session.last_seen = ts
+        self.sessions.move_to_end(key)
+
+        if distance_km <= CROSSING_DWELL_KM:
+            session.dwell_until = ts
+        elif session.dwell_until is not None and distance_km >= CROSSING_EXIT_KM:
+            del self.sessions[key]
+            return device_id, checkpoint_id, session.started_at, session.dwell_until
+        elif distance_km > CROSSING_APPROACH_KM:
+            # Уехал, не доехав до поста
+            del self.sessions[key]
+        return None
+
+    def expire(self, now: datetime):
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if now - session.last_seen <= CROSSING_SESSION_TIMEOUT:
+                break
+            del self.sessions[key]
+
+
+_sessionizer = Sessionizer()
+
+
+async def _checkpoint_coordinates(session) -> dict[int, tuple[float, float]]:
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return {cp_id: (snapshot.lat[pos], snapshot.lon[pos]) for pos, cp_id in enumerate(snapshot.ids)}
+    result = await session.execute(select(Checkpoint.id, Checkpoint.lat, Checkpoint.lon))
+    return {cp_id: (lat, lon) for cp_id, lat, lon in result}
+
+
+async def process_new_pings(until: datetime) -> int:
+    """Прогоняет пинги из (водяной знак, until] через сессии и сохраняет завершённые проезды.
+
+    Каждый проход читает только новые пинги. Если состояние процесса не соответствует
+    водяному знаку в job_status (первый проход или лидер менялся), сессии восстанавливаются
+    повторным чтением последних CROSSING_MAX_DURATION; уже записанные проезды при этом
+    не дублируются благодаря первичному ключу (device_id, checkpoint_id, started_at).
+    Так же пересчитывается хвост с самого раннего опоздавшего пинга — записанного буфером
+    уже после прошлого прохода, но с временем до его водяного знака.
+    Возвращает число записанных проездов.
+    """
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(JobStatus.watermark).where(JobStatus.job == CROSSINGS_JOB))
+            watermark = result.scalar()
+            coordinates = await _checkpoint_coordinates(session)
+
+            late = None
+            if watermark is not None:
+                # Прошлый проход читал пинги в момент watermark + STATS_WATERMARK_LAG
+                late = await session.scalar(
+                    select(func.min(LocationPing.timestamp)).where(
+                        LocationPing.checkpoint_id.is_not(None),
+                        LocationPing.inserted_at > watermark + STATS_WATERMARK_LAG,
+                        LocationPing.timestamp <= watermark,
+                    )
+                )
+
+            if late is not None:
+                logger.warning("Разметка пингов: найдены пинги с %s, записанные после прошлого прохода", late)
+                _sessionizer.reset()
+                start = max(late - CROSSING_MAX_DURATION, until - LOCATION_ENTRY_TTL)
+            elif watermark is not None and _sessionizer.until == watermark:
+                start = watermark
+            else:
+                _sessionizer.reset()
+                start = max((watermark or until) - CROSSING_MAX_DURATION, until - LOCATION_ENTRY_TTL)
+
+            stmt = (
+                select(LocationPing.device_id, LocationPing.checkpoint_id, LocationPing.lat, LocationPing.lon, LocationPing.timestamp)
+                .where(
+                    LocationPing.checkpoint_id.is_not(None),
+                    LocationPing.timestamp > start,
+                    LocationPing.timestamp <= until,
+                )
+                .order_by(LocationPing.timestamp)
+                .execution_options(yield_per=CROSSING_READ_CHUNK, query_name="crossing_pings")
+            )
+
+            crossings = []
+            pings = 0
+            stream = await session.stream(stmt)
+            async for chunk in stream.partitions():
+                for device_id, checkpoint_id, lat, lon, ts in chunk:
+                    point = coordinates.get(checkpoint_id)
+                    if point is None:
+                        continue
+                    crossing = _sessionizer.feed(device_id, checkpoint_id, ts, haversine_km(lat, lon, *point))
+                    if crossing is not None:
+                        crossings.append(crossing)
+                pings += len(chunk)
+                # Разметка идёт в event loop: между пачками отдаём управление запросам API
+                await asyncio.sleep(0)
+            await session.commit()
+        _sessionizer.expire(until)
+
+        async with AsyncSessionLocal() as session:
+            now = datetime.now(timezone.utc)
+            for offset in range(0, len(crossings), CROSSING_READ_CHUNK):
+                await session.execute(
+                    pg_insert(ObservedCrossing)
+                    .values([
+                        {
+                            "device_id": device_id,
+                            "checkpoint_id": checkpoint_id,
+                            "started_at": started_at,
+                            "finished_at": finished_at,
+                            "wait_hours": (finished_at - started_at).total_seconds() / 3600,
+                            "recorded_at": now,
+                        }
+                        for device_id, checkpoint_id, started_at, finished_at in crossings[offset:offset + CROSSING_READ_CHUNK]
+                    ])
+                    .on_conflict_do_nothing(index_elements=["device_id", "checkpoint_id", "started_at"])
+                )
+            await session.execute(
+                pg_insert(JobStatus)
+                .values(job=CROSSINGS_JOB, watermark=until)
+                .on_conflict_do_update(index_elements=["job"], set_={"watermark": until})
+            )
+            await session.commit()
+    except Exception:
+        # Состояние в памяти могло уйти дальше сохранённого водяного знака — следующий проход восстановит его
+        _sessionizer.reset()
+        raise
+
+    _sessionizer.until = until
+    logger.info(
+        "Разметка пингов: %d пингов с %s, %d проездов, %d открытых сессий, вытеснено %d",
+        pings, start, len(crossings), len(_sessionizer.sessions), _sessionizer.evicted
+    )
+    return len(crossings)
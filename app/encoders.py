@@ -0,0 +1,110 @@
+import json
+from typing import Iterator
+from fastapi import Request
+from app.schemas import CheckpointOut
+from app.settings import NDJSON_CHUNK_ROWS
+
+try:
+    import msgpack
+except ImportError:  # без msgpack клиенту отдаётся JSON
+    msgpack = None
+
+
+CHECKPOINT_FIELDS = tuple(CheckpointOut.model_fields)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+
+
+def parse_fields(raw: str | None) -> tuple[str, ...] | None:
+    """Разбирает fields=id,latitude,... Порядок полей в ответе совпадает с CheckpointOut."""
+    if not raw:
+        return None
+    requested = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = requested.difference(CHECKPOINT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in CHECKPOINT_FIELDS if f in requested)
+
+
+def _accepted_media_types(accept: str) -> list[tuple[str, float]]:
+    """Разбирает Accept в пары (media type, q); q=0 и битые q отбрасываются."""
+    accepted = []
+    for item in accept.lower().split(","):
+        media_type, *params = item.split(";")
+        media_type = media_type.strip()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        if 0 < q <= 1:
+            accepted.append((media_type, q))
+    return accepted
+
+
+def negotiate_format(request: Request) -> tuple[str, str]:
+    """Возвращает (формат, media type) по заголовку Accept: json, msgpack или ndjson.
+
+    Выбирается поддерживаемый тип с наибольшим q; при равных q конкретный тип важнее
+    */* и application/* (они означают JSON), а из конкретных — указанный раньше.
+    Без подходящих типов отдаётся JSON.
+    """
+    best, best_rank = ("json", JSON_MEDIA_TYPE), (0.0, False)
+    for media_type, q in _accepted_media_types(request.headers.get("accept", "")):
+        if media_type in MSGPACK_MEDIA_TYPES and msgpack is not None:
+            candidate = ("msgpack", MSGPACK_MEDIA_TYPES[0])
+        elif media_type in NDJSON_MEDIA_TYPES:
+            candidate = ("ndjson", NDJSON_MEDIA_TYPES[0])
+        elif media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            candidate = ("json", JSON_MEDIA_TYPE)
+        else:
+            continue
+        rank = (q, not media_type.endswith("/*"))
+        if rank > best_rank:
+            best, best_rank = candidate, rank
+    return best
+
+
+def records(columns: dict[str, list], fields: tuple[str, ...]) -> list[dict]:
+    return [dict(zip(fields, values)) for values in zip(*(columns[f] for f in fields))]
+
+
+def encode(columns: dict[str, list], fields: tuple[str, ...], fmt: str, layout: str) -> bytes:
+    """Кодирует выборку КПП, заданную столбцами, в строчный или столбцовый вид.
+
+    Столбцовый вид: {"count": n, "fields": [...], "id": [...], "latitude": [...], ...} —
+    имена полей не повторяются в каждой записи.
+    """
+    if layout == "columnar":
+        count = len(columns[fields[0]]) if fields else 0
+        payload = {"count": count, "fields": list(fields), **{f: columns[f] for f in fields}}
+    else:
+        payload = records(columns, fields)
+
+    if fmt == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def ndjson_lines(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Склеивает строки NDJSON в куски по NDJSON_CHUNK_ROWS, чтобы не писать в сокет по строке."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= NDJSON_CHUNK_ROWS:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def ndjson_records(columns: dict[str, list], fields: tuple[str, ...]) -> Iterator[bytes]:
+    for record in records(columns, fields):
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode()
@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import secrets
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import FeedbackLog
+from app.settings import FEEDBACK_LOGS_MAX_BYTES, FEEDBACK_LOGS_ZSTD_LEVEL, FEEDBACK_LOGS_GZIP_LEVEL
+
+try:
+    import zstandard
+except ImportError:  # zstandard не обязателен, без него логи сжимаются gzip
+    zstandard = None
+
+
+class LogsTooLarge(Exception):
+    pass
+
+
+class LogCompressor:
+    """Потоковое сжатие логов с подсчётом sha256 исходных данных и ограничением размера."""
+
+    def __init__(self, max_bytes: int = FEEDBACK_LOGS_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha = hashlib.sha256()
+        self._chunks: list[bytes] = []
+
+        if zstandard is not None:
+            self.encoding = "zstd"
+            self._compressor = zstandard.ZstdCompressor(level=FEEDBACK_LOGS_ZSTD_LEVEL).compressobj()
+        else:
+            self.encoding = "gzip"
+            self._compressor = zlib.compressobj(FEEDBACK_LOGS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise LogsTooLarge(f"Logs exceed {self.max_bytes} bytes")
+        self._sha.update(chunk)
+        data = self._compressor.compress(chunk)
+        if data:
+            self._chunks.append(data)
+
+    def finish(self) -> tuple[str, bytes]:
+        self._chunks.append(self._compressor.flush())
+        return self._sha.hexdigest(), b"".join(self._chunks)
+
+
+async def store_logs(session: AsyncSession, compressor: LogCompressor) -> str:
+    """Сохраняет сжатые логи в feedback_logs и возвращает их sha256. Одинаковые логи хранятся один раз."""
+    digest, data = compressor.finish()
+    await session.execute(
+        pg_insert(FeedbackLog).values(
+            digest=digest,
+            encoding=compressor.encoding,
+            size=compressor.size,
+            compressed_size=len(data),
+            data=data,
+            created_at=datetime.now(timezone.utc)
+        ).on_conflict_do_update(
+            # Повторно присланные логи снова считаются свежими и не попадут под очистку сирот
+            index_elements=["digest"], set_={"created_at": datetime.now(timezone.utc)}
+        )
+    )
+    return digest
+
+
+def new_upload_token() -> tuple[str, str]:
+    """Одноразовый токен загрузки логов и его sha256 для хранения в feedback."""
+    token = secrets.token_urlsafe(32)
+    return token, hash_upload_token(token)
+
+
+def hash_upload_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decompress(log: FeedbackLog) -> bytes:
+    if log.size == 0:
+        return b""
+    if log.encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed logs")
+        return zstandard.ZstdDecompressor().decompress(log.data, max_output_size=log.size)
+    return gzip.decompress(log.data)
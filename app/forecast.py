@@ -0,0 +1,103 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import CheckpointForecast, JobStatus, QueueReport
+from app.settings import FORECAST_MIN_SAMPLES
+
+HOURS_PER_WEEK = 168
+FORECAST_JOB = "update_forecasts"
+
+
+def hour_of_week(ts: datetime) -> int:
+    ts = ts.astimezone(timezone.utc)
+    return ts.weekday() * 24 + ts.hour
+
+
+def _bin_averages(samples: list[int], sums: list[float], digits: int) -> list[float | None]:
+    return [
+        round(total / count, digits) if count >= FORECAST_MIN_SAMPLES else None
+        for count, total in zip(samples, sums)
+    ]
+
+
+async def apply_new_reports(session: AsyncSession, until: datetime) -> int:
+    """Добавляет в профили опросы, записанные в БД (inserted_at) после водяного знака и не позже until.
+
+    Опросы агрегируются в БД по (КПП, час недели), поэтому объём работы пропорционален
+    числу новых опросов; в Python правятся только 168-элементные массивы затронутых КПП.
+    Водяной знак хранится в job_status и сдвигается в той же транзакции, что и профили,
+    так что каждый опрос учитывается ровно один раз — и опрос, дописанный буфером после
+    долгого сбоя со старым submitted_at, тоже. Возвращает число обновлённых КПП.
+    """
+    result = await session.execute(select(JobStatus.watermark).where(JobStatus.job == FORECAST_JOB))
+    watermark = result.scalar()
+
+    submitted_utc = func.timezone("UTC", QueueReport.submitted_at)
+    how = cast((func.extract("isodow", submitted_utc) - 1) * 24 + func.extract("hour", submitted_utc), Integer)
+    stmt = (
+        select(
+            QueueReport.checkpoint_id,
+            how,
+            func.count(),
+            func.sum(QueueReport.waiting_time_hours),
+            func.sum(QueueReport.waiting_time_hours * QueueReport.throughput_vehicles_per_hour),
+        )
+        .where(QueueReport.inserted_at <= until)
+        .group_by(QueueReport.checkpoint_id, how)
+        .execution_options(query_name="forecast_new_reports")
+    )
+    if watermark is not None:
+        stmt = stmt.where(QueueReport.inserted_at > watermark)
+
+    new_bins = defaultdict(list)
+    for checkpoint_id, hour, count, wait_sum, queue_sum in await session.execute(stmt):
+        new_bins[checkpoint_id].append((hour, count, wait_sum, queue_sum))
+
+    if new_bins:
+        result = await session.execute(
+            select(CheckpointForecast).where(CheckpointForecast.checkpoint_id.in_(new_bins.keys()))
+        )
+        existing = {f.checkpoint_id: f for f in result.scalars().all()}
+
+        rows = []
+        for checkpoint_id, bins in new_bins.items():
+            current = existing.get(checkpoint_id)
+            samples = list(current.samples) if current else [0] * HOURS_PER_WEEK
+            wait_sums = list(current.wait_sums) if current else [0.0] * HOURS_PER_WEEK
+            queue_sums = list(current.queue_sums) if current else [0.0] * HOURS_PER_WEEK
+            for hour, count, wait_sum, queue_sum in bins:
+                samples[hour] += count
+                wait_sums[hour] += wait_sum
+                queue_sums[hour] += queue_sum
+
+            rows.append({
+                "checkpoint_id": checkpoint_id,
+                "samples": samples,
+                "wait_sums": wait_sums,
+                "queue_sums": queue_sums,
+                "wait_avg": _bin_averages(samples, wait_sums, 2),
+                "queue_avg": _bin_averages(samples, queue_sums, 0),
+                "updated_at": until,
+            })
+
+        stmt = pg_insert(CheckpointForecast).values(rows)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["checkpoint_id"],
+                set_={name: stmt.excluded[name] for name in rows[0] if name != "checkpoint_id"}
+            )
+        )
+
+    await session.execute(
+        pg_insert(JobStatus)
+        .values(job=FORECAST_JOB, watermark=until)
+        .on_conflict_do_update(index_elements=["job"], set_={"watermark": until})
+    )
+    return len(new_bins)
+
+
+async def fetch_forecast(session: AsyncSession, checkpoint_id: int) -> CheckpointForecast | None:
+    result = await session.execute(select(CheckpointForecast).where(CheckpointForecast.checkpoint_id == checkpoint_id))
+    return result.scalar_one_or_none()
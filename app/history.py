@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import CheckpointStatsHistory
+from app.retention import delete_in_batches
+from app.settings import STATS_HISTORY_RESOLUTIONS, STATS_HISTORY_MAX_POINTS, STATS_WRITE_CHUNK
+
+_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def bucket_start(ts: datetime, step: timedelta) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    return ts - (ts - _EPOCH) % step
+
+
+async def record_stats(session: AsyncSession, stats: dict[int, tuple[float, int]], now: datetime):
+    """Добавляет результат прохода статистики во все уровни истории upsert'ами по STATS_WRITE_CHUNK строк.
+
+    Свёртки поддерживаются сразу при записи: корзина хранит число замеров, суммы и
+    min/max, поэтому отдельной задачи агрегации нет. Замер пишется только для КПП,
+    пересчитанных в этом проходе; пустая корзина означает, что новых опросов не было.
+    """
+    if not stats:
+        return
+
+    rows = [
+        {
+            "checkpoint_id": cp_id,
+            "resolution": resolution,
+            "bucket_start": bucket_start(now, step),
+            "samples": 1,
+            "wait_sum": avg_wait,
+            "wait_min": avg_wait,
+            "wait_max": avg_wait,
+            "queue_sum": avg_queue,
+        }
+        for cp_id, (avg_wait, avg_queue) in stats.items()
+        for resolution, (step, _) in STATS_HISTORY_RESOLUTIONS.items()
+    ]
+    for offset in range(0, len(rows), STATS_WRITE_CHUNK):
+        stmt = pg_insert(CheckpointStatsHistory).values(rows[offset:offset + STATS_WRITE_CHUNK])
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["checkpoint_id", "resolution", "bucket_start"],
+                set_={
+                    "samples": CheckpointStatsHistory.samples + stmt.excluded.samples,
+                    "wait_sum": CheckpointStatsHistory.wait_sum + stmt.excluded.wait_sum,
+                    "wait_min": func.least(CheckpointStatsHistory.wait_min, stmt.excluded.wait_min),
+                    "wait_max": func.greatest(CheckpointStatsHistory.wait_max, stmt.excluded.wait_max),
+                    "queue_sum": CheckpointStatsHistory.queue_sum + stmt.excluded.queue_sum,
+                }
+            )
+        )
+
+
+async def cleanup_history(now: datetime) -> int:
+    """Удаляет корзины старше срока хранения своего уровня."""
+    deleted = 0
+    for resolution, (_, keep) in STATS_HISTORY_RESOLUTIONS.items():
+        deleted += await delete_in_batches(
+            CheckpointStatsHistory,
+            and_(CheckpointStatsHistory.resolution == resolution, CheckpointStatsHistory.bucket_start < now - keep)
+        )
+    return deleted
+
+
+def choose_resolution(start: datetime, end: datetime, now: datetime) -> str:
+    """Самый подробный уровень, который ещё хранит start и даёт не больше STATS_HISTORY_MAX_POINTS точек."""
+    for resolution, (step, keep) in STATS_HISTORY_RESOLUTIONS.items():
+        if start >= now - keep and (end - start) / step <= STATS_HISTORY_MAX_POINTS:
+            return resolution
+    return next(reversed(STATS_HISTORY_RESOLUTIONS))
+
+
+async def fetch_history(session: AsyncSession, checkpoint_id: int, resolution: str, start: datetime, end: datetime) -> list:
+    step, _ = STATS_HISTORY_RESOLUTIONS[resolution]
+    result = await session.execute(
+        select(
+            CheckpointStatsHistory.bucket_start,
+            CheckpointStatsHistory.samples,
+            CheckpointStatsHistory.wait_sum,
+            CheckpointStatsHistory.wait_min,
+            CheckpointStatsHistory.wait_max,
+            CheckpointStatsHistory.queue_sum,
+        )
+        .where(
+            CheckpointStatsHistory.checkpoint_id == checkpoint_id,
+            CheckpointStatsHistory.resolution == resolution,
+            CheckpointStatsHistory.bucket_start >= bucket_start(start, step),
+            CheckpointStatsHistory.bucket_start < end,
+        )
+        .order_by(CheckpointStatsHistory.bucket_start)
+    )
+    return result.all()
@@ -0,0 +1,99 @@
+import gzip
+from typing import Callable
+from fastapi import Request, Response, status
+from app.settings import RESPONSE_COMPRESS_MIN_BYTES, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен, без него отдаём gzip
+    brotli = None
+
+
+class CachedBody:
+    """Готовое тело JSON-ответа с лениво сжатыми вариантами."""
+
+    __slots__ = ("body", "_encoded")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self._encoded: dict[str, bytes] = {}
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=RESPONSE_BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+            self._encoded[encoding] = data
+        return data
+
+
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Для If-None-Match допускается слабое сравнение (RFC 9110, 13.1.2)
+    candidates = (c.strip().removeprefix("W/") for c in header.split(","))
+    return etag in candidates
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(request: Request) -> str | None:
+    accepted = accepted_encodings(request)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def not_modified(etag: str, headers: dict | None = None) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **(headers or {})}
+    )
+
+
+def cached_response(
+    request: Request,
+    etag: str,
+    load: Callable[[], CachedBody],
+    headers: dict | None = None,
+    media_type: str = "application/json"
+) -> Response:
+    """Отвечает 304 по ETag, не трогая тело, иначе отдаёт готовое (и при возможности сжатое) тело."""
+    encoding = choose_encoding(request)
+    # Строгий ETag различается для каждого варианта кодирования тела
+    variant_etag = etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+    for candidate in (variant_etag, etag):
+        if etag_matches(request, candidate):
+            return not_modified(candidate, headers)
+
+    cached = load()
+    if len(cached.body) < RESPONSE_COMPRESS_MIN_BYTES:
+        encoding, variant_etag = None, etag
+
+    response_headers = {"ETag": variant_etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **(headers or {})}
+    body = cached.body
+    if encoding is not None:
+        body = cached.encoded(encoding)
+        response_headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type=media_type, headers=response_headers)
@@ -0,0 +1,312 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db import engine
+from app.metrics import Counter, GaugeCollector, register
+from app.models import QueueReport
+from app.settings import (
+    LOCATION_BUFFER_MAX_ROWS, LOCATION_BUFFER_FLUSH_INTERVAL, LOCATION_BUFFER_MAX_PENDING,
+    QUEUE_BUFFER_MAX_ROWS, QUEUE_BUFFER_FLUSH_INTERVAL, QUEUE_BUFFER_MAX_PENDING
+)
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+ingest_dropped_rows = register(Counter(
+    "gatemap_ingest_dropped_rows_total", "Строки, потерянные буфером при переполнении после неудачного сброса", ("buffer",)
+))
+ingest_rejected_rows = register(Counter(
+    "gatemap_ingest_rejected_rows_total", "Строки, отклонённые БД с постоянной ошибкой и выброшенные из буфера", ("buffer",)
+))
+
+# Классы SQLSTATE, повтор которых не поможет: 22 — недопустимые данные,
+# 23 — нарушение ограничений (в т.ч. внешний ключ и отсутствие секции для строки)
+PERMANENT_SQLSTATE_CLASSES = ("22", "23")
+
+
+def is_permanent_error(e: Exception) -> bool:
+    # COPY идёт через соединение драйвера, и его ошибки не обёрнуты в DBAPIError
+    sqlstate = getattr(getattr(e, "orig", e), "sqlstate", None)
+    return sqlstate is not None and sqlstate[:2] in PERMANENT_SQLSTATE_CLASSES
+
+
+class WriteBehindBuffer(ABC):
+    """Буфер отложенной записи: копит строки в памяти и сбрасывает их в БД пачкой.
+
+    Сброс происходит по достижении max_rows или раз в flush_interval секунд.
+    Подклассы хранят строки и умеют их забрать, вернуть и записать; цикл и метрики — общие.
+    При временной ошибке (нет соединения, таймаут) пачка возвращается в буфер; при постоянной
+    пачка делится пополам, пока плохие строки не окажутся по одной, — они пишутся в лог и выбрасываются.
+    """
+
+    name = "buffer"
+
+    def __init__(self, max_rows: int, flush_interval: float, max_pending: int):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        self.rejected_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+    @abstractmethod
+    def _take(self) -> list:
+        ...
+
+    @abstractmethod
+    def _restore(self, rows: list) -> int:
+        """Возвращает в буфер строки неудачного сброса, не превышая max_pending; возвращает число отброшенных."""
+
+    @abstractmethod
+    async def _write(self, rows: list):
+        ...
+
+    async def _added(self):
+        if len(self) >= self.max_rows:
+            self._wakeup.set()
+        # Обратное давление: если БД не успевает, клиент ждёт сброса, а не растит память
+        if len(self) >= self.max_pending:
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if len(self):
+            logger.error("[%s] При остановке не записано %d строк", self.name, len(self))
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            rows = self._take()
+            if not rows:
+                return
+
+            started = time.perf_counter()
+            try:
+                await self._write(rows)
+                written = len(rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                if not is_permanent_error(e):
+                    logger.exception("[%s] Ошибка записи пачки из %d строк: %s", self.name, len(rows), e)
+                    self._requeue(rows)
+                    return
+                logger.warning("[%s] БД отклонила пачку из %d строк, ищем плохие строки: %s", self.name, len(rows), e)
+                written, unwritten = await self._write_isolating(rows)
+                if unwritten:
+                    self._requeue(unwritten)
+                if not written:
+                    return
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flush_count += 1
+            self.flushed_rows += written
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            logger.debug("[%s] Записано %d строк за %.1f мс", self.name, len(rows), elapsed_ms)
+
+    def _requeue(self, rows: list):
+        dropped = self._restore(rows)
+        if dropped:
+            self.dropped_rows += dropped
+            ingest_dropped_rows.inc(self.name, amount=dropped)
+            logger.warning("[%s] Буфер переполнен: отброшено %d строк", self.name, dropped)
+
+    async def _write_isolating(self, rows: list) -> tuple[int, list]:
+        """Пишет пачку половинами, выбрасывая строки с постоянной ошибкой.
+
+        Плохих строк обычно единицы, поэтому записей O(k log n). Если по пути БД стала
+        недоступна, недописанные строки возвращаются для повтора. Возвращает (записано, недописано).
+        """
+        written = 0
+        parts = [rows]
+        while parts:
+            part = parts.pop()
+            try:
+                await self._write(part)
+                written += len(part)
+            except Exception as e:
+                if not is_permanent_error(e):
+                    logger.exception("[%s] Ошибка записи при разборе пачки: %s", self.name, e)
+                    return written, [row for rest in parts for row in rest] + part
+                if len(part) > 1:
+                    middle = len(part) // 2
+                    parts.append(part[middle:])
+                    parts.append(part[:middle])
+                    continue
+                self.rejected_rows += 1
+                ingest_rejected_rows.inc(self.name)
+                logger.error("[%s] Строка отклонена БД и выброшена: %r: %s", self.name, part[0], e)
+        return written, []
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self),
+            "flush_count": self.flush_count,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "dropped_rows": self.dropped_rows,
+            "rejected_rows": self.rejected_rows,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 3) if self.flush_count else 0.0,
+        }
+
+
+class LocationPingBuffer(WriteBehindBuffer):
+    """Пинги координат, записываемые в location_pings через COPY."""
+
+    name = "location_pings"
+
+    COPY_SQL = "COPY location_pings (id, device_id, lat, lon, timestamp, checkpoint_id) FROM STDIN"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rows: list[tuple] = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    async def add(self, rows: list[tuple]):
+        self._rows.extend(rows)
+        await self._added()
+
+    def _take(self) -> list:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def _restore(self, rows: list) -> int:
+        # Неудачная пачка возвращается в начало очереди, но не сверх лимита: отбрасываются самые старые
+        rows = rows + self._rows
+        self._rows = rows[-self.max_pending:]
+        return len(rows) - len(self._rows)
+
+    async def _write(self, rows: list):
+        # engine.begin() фиксирует транзакцию драйвера, в которой выполнился COPY
+        async with engine.begin() as conn:
+            raw = await conn.get_raw_connection()
+            async with raw.driver_connection.cursor() as cursor:
+                async with cursor.copy(self.COPY_SQL) as copy:
+                    for row in rows:
+                        await copy.write_row(row)
+
+
+class QueueReportBuffer(WriteBehindBuffer):
+    """Опросы об очереди, схлопнутые по (device_id, checkpoint_id) как в uix_queue_device_checkpoint.
+
+    Повторные отправки одного устройства по одному КПП до сброса заменяют друг друга,
+    поэтому в БД уходит только последний опрос на ключ.
+    """
+
+    name = "queue_reports"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending: dict[tuple[str, int], dict] = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, row: dict):
+        key = (row["device_id"], row["checkpoint_id"])
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = row
+        await self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def _restore(self, rows: list) -> int:
+        dropped = 0
+        for row in rows:
+            key = (row["device_id"], row["checkpoint_id"])
+            # Более свежие опросы, пришедшие во время неудачного сброса, не перезаписываем
+            if key in self._pending:
+                continue
+            if len(self._pending) >= self.max_pending:
+                dropped += 1
+                continue
+            self._pending[key] = row
+        return dropped
+
+    async def _write(self, rows: list):
+        async with engine.begin() as conn:
+            for start in range(0, len(rows), self.max_rows):
+                stmt = pg_insert(QueueReport).values(rows[start:start + self.max_rows])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["device_id", "checkpoint_id"],
+                    set_={
+                        "lat": stmt.excluded.lat,
+                        "lon": stmt.excluded.lon,
+                        "waiting_time_hours": stmt.excluded.waiting_time_hours,
+                        "throughput_vehicles_per_hour": stmt.excluded.throughput_vehicles_per_hour,
+                        "submitted_at": stmt.excluded.submitted_at,
+                        "inserted_at": func.now()
+                    }
+                )
+                await conn.execute(stmt)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "coalesced": self.coalesced}
+
+
+location_buffer = LocationPingBuffer(
+    max_rows=LOCATION_BUFFER_MAX_ROWS,
+    flush_interval=LOCATION_BUFFER_FLUSH_INTERVAL,
+    max_pending=LOCATION_BUFFER_MAX_PENDING
+)
+
+queue_report_buffer = QueueReportBuffer(
+    max_rows=QUEUE_BUFFER_MAX_ROWS,
+    flush_interval=QUEUE_BUFFER_FLUSH_INTERVAL,
+    max_pending=QUEUE_BUFFER_MAX_PENDING
+)
+
+
+register(GaugeCollector(
+    "gatemap_ingest_queue_depth", "Строки в буфере отложенной записи", ("buffer",),
+    lambda: [((b.name,), len(b)) for b in (location_buffer, queue_report_buffer)]
+))
+register(GaugeCollector(
+    "gatemap_ingest_last_flush_seconds", "Длительность последнего сброса буфера", ("buffer",),
+    lambda: [((b.name,), b.last_flush_ms / 1000) for b in (location_buffer, queue_report_buffer)]
+))
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import socket
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+from app.config import DATABASE_URL
+from app.db import AsyncSessionLocal
+from app.metrics import observe_job
+from app.models import JobStatus
+from app.profiling import profile_job
+from app.settings import LEADER_RETRY_INTERVAL, LEADER_HEARTBEAT_INTERVAL
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Соединения с advisory lock живут всё время лидерства, поэтому берутся не из общего пула.
+# TCP keepalive нужен, чтобы PostgreSQL быстро освободил лок упавшего воркера.
+_lock_engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=NullPool,
+    connect_args={"keepalives": 1, "keepalives_idle": 10, "keepalives_interval": 5, "keepalives_count": 3}
+)
+
+
+class JobLeader:
+    """Лидерство в фоновой задаче через сессионный pg_try_advisory_lock.
+
+    Лок держится, пока живо соединение; каждый heartbeat — это запрос по этому
+    соединению (продление аренды) и отметка heartbeat_at в job_status. Если соединение
+    оборвалось, воркер сразу перестаёт считать себя лидером, а PostgreSQL отпускает лок,
+    и его забирает следующий воркер при очередной попытке.
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.key = zlib.crc32(f"gatemap-job:{job}".encode())
+        self._conn: AsyncConnection | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    async def acquire(self) -> bool:
+        if self._conn is not None:
+            return await self.heartbeat()
+
+        conn = None
+        try:
+            conn = await _lock_engine.connect()
+            result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key})
+            acquired = bool(result.scalar())
+            await conn.commit()
+        except Exception as e:
+            logger.warning("[%s] Не удалось проверить лидерство: %s", self.job, e)
+            acquired = False
+
+        if not acquired:
+            if conn is not None:
+                await conn.close()
+            return False
+
+        self._conn = conn
+        logger.info("[%s] Воркер %s стал лидером", self.job, WORKER_ID)
+        now = datetime.now(timezone.utc)
+        await self.record(leader=WORKER_ID, leader_since=now, heartbeat_at=now)
+        return True
+
+    async def heartbeat(self) -> bool:
+        try:
+            await self._conn.execute(text("SELECT 1"))
+            await self._conn.commit()
+        except Exception as e:
+            logger.warning("[%s] Потеряно соединение лидера, лидерство сброшено: %s", self.job, e)
+            await self._drop()
+            return False
+        await self.record(heartbeat_at=datetime.now(timezone.utc))
+        return True
+
+    async def release(self):
+        if self._conn is None:
+            return
+        try:
+            await self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            await self._conn.commit()
+        except Exception:
+            pass
+        await self._drop()
+        # Лидер уходит штатно: следующий воркер может забрать задачу без ожидания
+        await self.record(leader=None, heartbeat_at=datetime.now(timezone.utc))
+
+    async def _drop(self):
+        conn, self._conn = self._conn, None
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def record(self, **values):
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    pg_insert(JobStatus)
+                    .values(job=self.job, **values)
+                    .on_conflict_do_update(index_elements=["job"], set_=values)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning("[%s] Не удалось обновить job_status: %s", self.job, e)
+
+
+async def run_periodic(
+    job: str,
+    interval: float,
+    run_once: Callable[[], Awaitable[None]],
+    error_message: str,
+    on_acquire: Callable[[], None] | None = None
+):
+    """Выполняет run_once раз в interval секунд только на воркере-лидере этой задачи.
+
+    on_acquire вызывается при каждом новом получении лидерства: состояние в памяти,
+    оставшееся от прошлого лидерства, устарело, пока задачу вёл другой воркер.
+    """
+    leader = JobLeader(job)
+    try:
+        while True:
+            was_leader = leader.is_leader
+            if not await leader.acquire():
+                await asyncio.sleep(LEADER_RETRY_INTERVAL)
+                continue
+            if not was_leader and on_acquire is not None:
+                on_acquire()
+
+            started = time.perf_counter()
+            started_at = datetime.now(timezone.utc)
+            await leader.record(last_started_at=started_at)
+            error = None
+            try:
+                async with profile_job(job):
+                    await run_once()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                logger.exception(error_message, e)
+            observe_job(job, started, ok=error is None)
+            await leader.record(
+                last_finished_at=datetime.now(timezone.utc),
+                last_duration_seconds=time.perf_counter() - started,
+                last_status="ok" if error is None else "error",
+                last_error=error
+            )
+
+            # Между проходами продлеваем аренду, чтобы потеря лидерства была видна сразу
+            deadline = time.monotonic() + interval
+            while (remaining := deadline - time.monotonic()) > 0:
+                await asyncio.sleep(min(LEADER_HEARTBEAT_INTERVAL, remaining))
+                if not await leader.heartbeat():
+                    break
+    finally:
+        await leader.release()
@@ -0,0 +1,352 @@
+import asyncio
+import math
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db import AsyncSessionLocal
+from app.leader import WORKER_ID
+from app.metrics import GaugeCollector, register
+from app.models import CheckpointLiveStats
+from app.settings import (
+    LIVE_STATS_WINDOW, LIVE_STATS_BUCKET, LIVE_STATS_ACCURACY, LIVE_STATS_MIN_VALUE,
+    LIVE_STATS_MIN_REPORTS, LIVE_STATS_SYNC_INTERVAL
+)
+from app.snapshot import publish_live
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_GAMMA = (1 + LIVE_STATS_ACCURACY) / (1 - LIVE_STATS_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_STEP = LIVE_STATS_BUCKET.total_seconds()
+_SLOTS = int(LIVE_STATS_WINDOW / LIVE_STATS_BUCKET)
+
+
+def _epoch(ts: datetime) -> int:
+    return int(ts.timestamp() // _STEP)
+
+
+def _epoch_start(epoch: int) -> datetime:
+    return datetime.fromtimestamp(epoch * _STEP, tz=timezone.utc)
+
+
+def sketch_key(value: float) -> int | None:
+    """Корзина скетча для значения, None — нулевая корзина (меньше LIVE_STATS_MIN_VALUE)."""
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"Invalid wait value: {value!r}")
+    if value < LIVE_STATS_MIN_VALUE:
+        return None
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+class QuantileSketch:
+    """Квантильный скетч с относительной погрешностью LIVE_STATS_ACCURACY (как DDSketch).
+
+    Значение x попадает в корзину ceil(log_gamma(x)), gamma = (1 + a) / (1 - a); корзины
+    складываются без потерь, поэтому скетчи корзин окна и разных воркеров просто суммируются.
+    """
+
+    __slots__ = ("zero", "bins", "count")
+
+    def __init__(self):
+        self.zero = 0
+        self.bins: dict[int, int] = {}
+        self.count = 0
+
+    def add(self, value: float):
+        self.add_key(sketch_key(value))
+
+    def add_key(self, key: int | None):
+        self.count += 1
+        if key is None:
+            self.zero += 1
+        else:
+            self.bins[key] = self.bins.get(key, 0) + 1
+
+    def remove_key(self, key: int | None):
+        self.count -= 1
+        if key is None:
+            self.zero -= 1
+            return
+        left = self.bins[key] - 1
+        if left:
+            self.bins[key] = left
+        else:
+            del self.bins[key]
+
+    def merge(self, other: "QuantileSketch"):
+        self.zero += other.zero
+        self.count += other.count
+        for key, n in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        value = 0.0
+        for key in sorted(self.bins):
+            if rank < seen:
+                break
+            seen += self.bins[key]
+            # Середина корзины (gamma^(key-1), gamma^key] в относительной мере
+            value = 2 * _GAMMA ** key / (_GAMMA + 1)
+        return value
+
+    @classmethod
+    def from_row(cls, zero: int, bins: list[int], counts: list[int]) -> "QuantileSketch":
+        sketch = cls()
+        sketch.zero = zero
+        sketch.bins = dict(zip(bins, counts))
+        sketch.count = zero + sum(counts)
+        return sketch
+
+
+class LiveWindow:
+    """Кольцевой буфер из LIVE_STATS_WINDOW / LIVE_STATS_BUCKET корзин, в каждой свой скетч.
+
+    Слот корзины — номер корзины по модулю длины кольца; устаревший слот обнуляется
+    при первой записи в него, поэтому добавление опроса — O(1).
+    Как и буфер опросов, окно хранит один опрос на устройство: повторная отправка
+    заменяет прежнее значение, где бы в окне оно ни лежало.
+    """
+
+    __slots__ = ("epochs", "sketches", "devices")
+
+    def __init__(self):
+        self.epochs = [-1] * _SLOTS
+        self.sketches: list[QuantileSketch | None] = [None] * _SLOTS
+        self.devices: dict[str, tuple[int, int | None]] = {}
+
+    def add(self, epoch: int, value: float, device_id: str) -> int | None:
+        """Добавляет опрос; возвращает корзину, из которой убран прежний опрос устройства.
+
+        Недопустимое значение отвергается (ValueError) до любого изменения окна.
+        """
+        key = sketch_key(value)
+        replaced = None
+        previous = self.devices.get(device_id)
+        if previous is not None:
+            old_epoch, old_key = previous
+            sketch = self.get(old_epoch)
+            if sketch is not None:
+                sketch.remove_key(old_key)
+                replaced = old_epoch
+
+        slot = epoch % _SLOTS
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.sketches[slot] = QuantileSketch()
+        self.sketches[slot].add_key(key)
+        self.devices[device_id] = (epoch, key)
+        return replaced
+
+    def prune(self, current: int):
+        self.devices = {
+            device_id: entry for device_id, entry in self.devices.items() if entry[0] > current - _SLOTS
+        }
+
+    def put(self, epoch: int, sketch: QuantileSketch):
+        slot = epoch % _SLOTS
+        if epoch >= self.epochs[slot]:
+            self.epochs[slot] = epoch
+            self.sketches[slot] = sketch
+
+    def get(self, epoch: int) -> QuantileSketch | None:
+        slot = epoch % _SLOTS
+        return self.sketches[slot] if self.epochs[slot] == epoch else None
+
+    def merge_into(self, total: QuantileSketch, current: int) -> bool:
+        """Добавляет корзины текущего окна в total; False — в окне ничего нет."""
+        found = False
+        for epoch, sketch in zip(self.epochs, self.sketches):
+            if current - _SLOTS < epoch <= current:
+                total.merge(sketch)
+                found = True
+        return found
+
+
+class LiveStats:
+    """Скользящие окна опросов по КПП: свои (принятые этим воркером) и загруженные из БД.
+
+    Своё окно обновляется при приёме опроса; раз в LIVE_STATS_SYNC_INTERVAL изменённые
+    корзины записываются в checkpoint_live_stats под WORKER_ID, а корзины других воркеров
+    (и прежних процессов до рестарта) читаются оттуда же и заменяют загруженные ранее.
+    """
+
+    def __init__(self):
+        self.local: dict[int, LiveWindow] = {}
+        self.remote: dict[int, dict[str, LiveWindow]] = {}
+        self.dirty: set[tuple[int, int]] = set()
+        self.changed: set[int] = set()
+        self.loaded_until: datetime | None = None
+        self.estimated_epoch: int | None = None
+        self.estimates: dict[int, tuple[float, float, int]] = {}
+
+    def record(self, checkpoint_id: int, device_id: str, ts: datetime, wait_hours: float):
+        if not math.isfinite(wait_hours) or wait_hours < 0:
+            # Опрос уже принят в буфер; в оперативную статистику такое значение не попадает
+            logger.warning("Опрос КПП %d с недопустимым ожиданием %r не учтён в оперативной статистике", checkpoint_id, wait_hours)
+            return
+        epoch = _epoch(ts)
+        window = self.local.get(checkpoint_id)
+        if window is None:
+            window = self.local[checkpoint_id] = LiveWindow()
+        replaced = window.add(epoch, wait_hours, device_id)
+        self.dirty.add((checkpoint_id, epoch))
+        if replaced is not None:
+            self.dirty.add((checkpoint_id, replaced))
+        self.changed.add(checkpoint_id)
+
+    def estimate(self, checkpoint_id: int, now: datetime) -> tuple[float, float, int] | None:
+        """(медиана, p90, число опросов) за окно или None, если опросов меньше LIVE_STATS_MIN_REPORTS."""
+        current = _epoch(now)
+        total = QuantileSketch()
+        found = False
+        window = self.local.get(checkpoint_id)
+        if window is not None:
+            window.prune(current)
+            found = window.merge_into(total, current)
+        for window in self.remote.get(checkpoint_id, {}).values():
+            found = window.merge_into(total, current) or found
+        if not found:
+            self.local.pop(checkpoint_id, None)
+            self.remote.pop(checkpoint_id, None)
+        if total.count < LIVE_STATS_MIN_REPORTS:
+            return None
+        return round(total.quantile(0.5), 2), round(total.quantile(0.9), 2), total.count
+
+    def refresh_estimates(self, now: datetime) -> bool:
+        """Пересчитывает оценки изменившихся КПП (всех — при сдвиге окна); True, если что-то поменялось."""
+        current = _epoch(now)
+        if current != self.estimated_epoch:
+            checkpoint_ids = set(self.local) | set(self.remote) | set(self.estimates)
+            self.estimated_epoch = current
+        else:
+            checkpoint_ids = self.changed
+        self.changed = set()
+
+        updated = False
+        for checkpoint_id in checkpoint_ids:
+            value = self.estimate(checkpoint_id, now)
+            if value == self.estimates.get(checkpoint_id):
+                continue
+            if value is None:
+                del self.estimates[checkpoint_id]
+            else:
+                self.estimates[checkpoint_id] = value
+            updated = True
+        return updated
+
+    async def flush(self, now: datetime) -> int:
+        """Записывает изменённые корзины своего окна; при ошибке они останутся к следующему разу."""
+        dirty, self.dirty = self.dirty, set()
+        oldest = _epoch(now) - _SLOTS
+        rows = []
+        for checkpoint_id, epoch in dirty:
+            sketch = self.local[checkpoint_id].get(epoch) if checkpoint_id in self.local else None
+            if sketch is None or epoch <= oldest:
+                continue
+            rows.append({
+                "worker": WORKER_ID,
+                "checkpoint_id": checkpoint_id,
+                "bucket_start": _epoch_start(epoch),
+                "zero_count": sketch.zero,
+                "bins": list(sketch.bins),
+                "counts": list(sketch.bins.values()),
+                # Время БД, а не воркера: по нему другие воркеры подгружают изменения
+                "updated_at": func.now(),
+            })
+        if not rows:
+            return 0
+
+        try:
+            async with AsyncSessionLocal() as session:
+                stmt = pg_insert(CheckpointLiveStats).values(rows)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["worker", "checkpoint_id", "bucket_start"],
+                        set_={
+                            "zero_count": stmt.excluded.zero_count,
+                            "bins": stmt.excluded.bins,
+                            "counts": stmt.excluded.counts,
+                            "updated_at": stmt.excluded.updated_at,
+                        }
+                    )
+                )
+                await session.commit()
+        except Exception:
+            self.dirty |= dirty
+            raise
+        return len(rows)
+
+    async def load(self, now: datetime) -> int:
+        """Подгружает корзины других воркеров, изменённые с прошлой загрузки."""
+        stmt = select(
+            CheckpointLiveStats.worker,
+            CheckpointLiveStats.checkpoint_id,
+            CheckpointLiveStats.bucket_start,
+            CheckpointLiveStats.zero_count,
+            CheckpointLiveStats.bins,
+            CheckpointLiveStats.counts,
+            CheckpointLiveStats.updated_at,
+        ).where(
+            CheckpointLiveStats.worker != WORKER_ID,
+            CheckpointLiveStats.bucket_start > now - LIVE_STATS_WINDOW,
+        )
+        if self.loaded_until is not None:
+            # Перекрытие на случай транзакций, закоммиченных позже времени своего начала
+            stmt = stmt.where(CheckpointLiveStats.updated_at >= self.loaded_until - timedelta(seconds=2 * LIVE_STATS_SYNC_INTERVAL))
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(stmt)
+            rows = result.all()
+
+        for worker, checkpoint_id, bucket_start, zero_count, bins, counts, updated_at in rows:
+            windows = self.remote.setdefault(checkpoint_id, {})
+            window = windows.get(worker)
+            if window is None:
+                window = windows[worker] = LiveWindow()
+            window.put(_epoch(bucket_start), QuantileSketch.from_row(zero_count, bins, counts))
+            self.changed.add(checkpoint_id)
+            if self.loaded_until is None or updated_at > self.loaded_until:
+                self.loaded_until = updated_at
+        return len(rows)
+
+
+live_stats = LiveStats()
+
+
+async def sync_live_stats_once():
+    now = datetime.now(timezone.utc)
+    flushed = await live_stats.flush(now)
+    loaded = await live_stats.load(now)
+    if live_stats.refresh_estimates(now):
+        publish_live(dict(live_stats.estimates))
+    logger.debug("Оперативная статистика: записано %d корзин, загружено %d", flushed, loaded)
+
+
+async def sync_live_stats():
+    """Работает в каждом воркере: обмен корзинами через БД и публикация оценок в снимок."""
+    while True:
+        try:
+            await sync_live_stats_once()
+        except Exception as e:
+            logger.exception("Ошибка синхронизации оперативной статистики КПП: %s", e)
+
+        await asyncio.sleep(LIVE_STATS_SYNC_INTERVAL)
+
+
+async def flush_live_stats():
+    try:
+        await live_stats.flush(datetime.now(timezone.utc))
+    except Exception as e:
+        logger.exception("Не удалось сохранить оперативную статистику КПП: %s", e)
+
+
+register(GaugeCollector(
+    "gatemap_live_stats_checkpoints", "КПП с оперативной статистикой в этом процессе", (),
+    lambda: [((), len(live_stats.estimates))]
+))
@@ -1,14 +1,27 @@
+import time
+_import_started = time.perf_counter()
+
 import sys
 import asyncio
+from datetime import datetime, timezone
 from fastapi import FastAPI
 from app.routes import router
-from app.tasks import cleanup_old_data, update_checkpoint_stats
+from app.ingest import location_buffer, queue_report_buffer
+from app.live_stats import flush_live_stats, sync_live_stats
+from app.metrics import MetricsMiddleware
+from app.migrations import run_migrations
+from app.profiling import ProfilingMiddleware, profiler
+from app.retention import prepare_partitions
+from app.snapshot import watch_snapshot
+from app.startup import startup_report
+from app.stats_pool import shutdown_pool
+from app.tasks import cleanup_old_data, detect_crossings, update_checkpoint_stats, update_forecasts
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from contextlib import asynccontextmanager
-from alembic.config import Config
-from alembic import command
 import logging
 
+startup_report.record("imports", time.perf_counter() - _import_started)
+
 logger = logging.getLogger(__name__)
 
 logging.basicConfig(
@@ -21,22 +34,45 @@ logging.basicConfig(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        run_migrations()
+        with startup_report.phase("migrations"):
+            await asyncio.to_thread(run_migrations)
     except Exception as e:
         logger.exception("Failed to apply Alembic migrations: %s", e)
         raise
-    asyncio.create_task(cleanup_old_data())
-    asyncio.create_task(update_checkpoint_stats())
+
+    try:
+        with startup_report.phase("partitions"):
+            created = await prepare_partitions(datetime.now(timezone.utc))
+        if created:
+            logger.info("Созданы секции location_pings: %s", ", ".join(created))
+    except Exception as e:
+        # Не фатально: секции создаст и проход очистки у лидера
+        logger.exception("Failed to create location_pings partitions: %s", e)
+
+    with startup_report.phase("background_tasks"):
+        asyncio.create_task(cleanup_old_data())
+        asyncio.create_task(update_checkpoint_stats())
+        asyncio.create_task(update_forecasts())
+        asyncio.create_task(detect_crossings())
+        asyncio.create_task(watch_snapshot())
+        asyncio.create_task(sync_live_stats())
+        location_buffer.start()
+        queue_report_buffer.start()
+    startup_report.log()
 
     yield
 
-    # shutdown: здесь можно добавить логику остановки (если нужно)
+    # Дописываем накопленные пинги и опросы до закрытия процесса
+    await location_buffer.stop()
+    await queue_report_buffer.stop()
+    await flush_live_stats()
+    shutdown_pool()
+    if profiler.stacks:
+        logger.info("Профили сохранены: %s", ", ".join(profiler.dump()))
 
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(HTTPSRedirectMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
 app.include_router(router)
-
-def run_migrations():
-    alembic_cfg = Config("alembic.ini")
-    command.upgrade(alembic_cfg, "head")
@@ -0,0 +1,231 @@
+import re
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Границы в секундах: от долей миллисекунды (снимок в памяти) до десятков секунд (фоновые задачи)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами; observe — это bisect и три сложения."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                labels = _labels((*self.labels, "le"), (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {count}"
+
+
+class GaugeCollector:
+    """Значения, снимаемые в момент запроса /metrics из состояния приложения."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], collect: Callable[[], Iterable[tuple[tuple, float]]]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in self.collect():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry: list = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_request_duration = register(Histogram(
+    "gatemap_http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status")
+))
+db_query_duration = register(Histogram(
+    "gatemap_db_query_duration_seconds", "Время выполнения SQL-запроса", ("statement", "query")
+))
+db_query_errors = register(Counter(
+    "gatemap_db_query_errors_total", "Ошибки выполнения SQL-запросов", ("statement", "query")
+))
+db_pool_checkout_wait = register(Histogram(
+    "gatemap_db_pool_checkout_wait_seconds", "Ожидание соединения из пула"
+))
+job_duration = register(Histogram(
+    "gatemap_job_duration_seconds", "Длительность прохода фоновой задачи", ("job",)
+))
+job_runs = register(Counter(
+    "gatemap_job_runs_total", "Проходы фоновых задач", ("job", "status")
+))
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность запроса по шаблону маршрута, а не по сырому пути."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status_code
+            )
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, измеряющий ожидание свободного соединения."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.observe(time.perf_counter() - started, *_query_labels(statement, context))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(context):
+        stack = context.connection.info.get("query_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+        db_query_errors.inc(*_query_labels(context.statement or "", context.execution_context))
+
+    register(GaugeCollector(
+        "gatemap_db_pool_checked_out", "Соединения, выданные из пула", (),
+        lambda: [((), sync_engine.pool.checkedout())]
+    ))
+
+
+# Основная таблица запроса: первая после FROM / INTO / UPDATE / COPY / TABLE
+_MAIN_TABLE = re.compile(
+    r'(?:\bFROM|\bINTO|^\s*UPDATE|^\s*COPY|\bTABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+"?([A-Za-z_][\w.]*)',
+    re.IGNORECASE
+)
+# Секции location_pings различаются только датой в имени
+_PARTITION_SUFFIX = re.compile(r"\d{6,}$")
+_FINGERPRINT_CACHE_SIZE = 1024
+_fingerprints: dict[str, tuple[str, str]] = {}
+
+
+def _query_labels(statement: str, context) -> tuple[str, str]:
+    """Метки SQL-запроса: тип и имя запроса.
+
+    Имя — тег execution_options(query_name=...) у горячих запросов, иначе основная таблица.
+    Обе метки берутся из ограниченного набора, поэтому число рядов не растёт с числом разных SQL.
+    """
+    kind, table = _fingerprint(statement)
+    query_name = context.execution_options.get("query_name") if context is not None else None
+    return kind, query_name or table
+
+
+def _fingerprint(statement: str) -> tuple[str, str]:
+    fingerprint = _fingerprints.get(statement)
+    if fingerprint is None:
+        if not statement.strip():
+            fingerprint = ("UNKNOWN", "-")
+        else:
+            match = _MAIN_TABLE.search(statement)
+            table = _PARTITION_SUFFIX.sub("*", match.group(1).lower()) if match else "-"
+            fingerprint = (statement.lstrip().split(None, 1)[0].upper(), table)
+        # Тексты многострочных INSERT различаются числом строк — кэш не должен расти без предела
+        if len(_fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        _fingerprints[statement] = fingerprint
+    return fingerprint
+
+
+def observe_job(job: str, started: float, ok: bool):
+    job_duration.observe(time.perf_counter() - started, job)
+    job_runs.inc(job, "ok" if ok else "error")
@@ -0,0 +1,72 @@
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, pool, text
+from app.config import MIGRATION_MODE
+from app.settings import MIGRATION_LOCK_KEY
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationsPending(RuntimeError):
+    pass
+
+
+def alembic_config() -> Config:
+    return Config("alembic.ini")
+
+
+def pending_revisions(connection, cfg: Config) -> tuple[set[str], set[str]]:
+    current = set(MigrationContext.configure(connection).get_current_heads())
+    heads = set(ScriptDirectory.from_config(cfg).get_heads())
+    return current, heads
+
+
+def run_migrations(mode: str = MIGRATION_MODE):
+    """Приводит схему к head с учётом режима запуска.
+
+    upgrade — воркер берёт advisory lock; применяет миграции только тот, кто первым
+              увидел отставание, остальные после ожидания лока делают лишь сверку ревизий;
+    check   — только сверка ревизий, при отставании запуск прерывается
+              (миграции применяет отдельный шаг: python -m app.migrations);
+    off     — ничего не делать.
+    """
+    if mode == "off":
+        logger.info("Миграции пропущены (MIGRATION_MODE=off)")
+        return
+
+    cfg = alembic_config()
+    engine = create_engine(cfg.get_main_option("sqlalchemy.url"), poolclass=pool.NullPool)
+    try:
+        with engine.connect() as conn:
+            current, heads = pending_revisions(conn, cfg)
+            conn.commit()
+            if current == heads:
+                logger.info("Схема БД актуальна: %s", ", ".join(sorted(heads)) or "без ревизий")
+                return
+            if mode == "check":
+                raise MigrationsPending(
+                    f"Схема БД отстаёт: {sorted(current)} вместо {sorted(heads)}; выполните python -m app.migrations"
+                )
+
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                # Пока мы ждали лок, миграции мог применить другой воркер
+                current, heads = pending_revisions(conn, cfg)
+                conn.commit()
+                if current != heads:
+                    logger.info("Применение миграций: %s -> %s", sorted(current), sorted(heads))
+                    command.upgrade(cfg, "head")
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    run_migrations("upgrade")
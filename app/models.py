@@ -2,9 +2,9 @@ from datetime import datetime, timezone
 import uuid
 from sqlalchemy import (
     Column, String, Integer, Float, DateTime, Boolean,
-    ForeignKey, UniqueConstraint, Text
+    ForeignKey, UniqueConstraint, Text, LargeBinary, func
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -23,6 +23,8 @@ class Checkpoint(Base):
     avg_wait_time_hours = Column(Float, nullable=False, default=0.0)
     avg_queue_size = Column(Integer, nullable=False, default=0)
     avg_updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    # False — свежих опросов меньше STATS_MIN_REPORTS, в списках показывается прогноз
+    stats_fresh = Column(Boolean, nullable=False, default=False, server_default="false")
 
     # Relationships
     reports = relationship("QueueReport", back_populates="checkpoint", cascade="all, delete-orphan")
@@ -38,7 +40,9 @@ class QueueReport(Base):
     waiting_time_hours = Column(Float, nullable=False)
     throughput_vehicles_per_hour = Column(Integer, nullable=False)
     device_id = Column(String, nullable=False)
-    submitted_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    submitted_at = Column(DateTime(timezone=True), nullable=False, index=True, default=lambda: datetime.now(timezone.utc))
+    # Время записи в БД: опрос из буфера после долгого сбоя сброса приходит со старым submitted_at
+    inserted_at = Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
 
     # Relationships
     checkpoint = relationship("Checkpoint", back_populates="reports")
@@ -51,12 +55,18 @@ class QueueReport(Base):
 class LocationPing(Base):
     __tablename__ = "location_pings"
 
+    # Ключ секционирования обязан входить в первичный ключ
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     device_id = Column(String, nullable=False)
     lat = Column(Float, nullable=False)
     lon = Column(Float, nullable=False)
-    timestamp = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    timestamp = Column(DateTime(timezone=True), primary_key=True, index=True, default=lambda: datetime.now(timezone.utc))
     checkpoint_id = Column(Integer, ForeignKey("checkpoints.id"), nullable=True)
+    # Время записи в БД: по нему находятся пинги, дописанные буфером после долгого сбоя сброса
+    inserted_at = Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
+
+    # Секции по часам создаёт и удаляет app/retention.py
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
 
 class Feedback(Base):
@@ -66,10 +76,23 @@ class Feedback(Base):
     message = Column(String, nullable=False)
     tag = Column(String, nullable=False)  # 'Ошибка' / 'Идея' / 'Другое'
     email = Column(String, nullable=True)
-    logs = Column(Text, nullable=True)
+    logs = Column(Text, nullable=True)  # устаревшее: новые логи лежат в feedback_logs
+    logs_digest = Column(String(64), ForeignKey("feedback_logs.digest"), nullable=True)
+    logs_upload_token = Column(String(64), nullable=True)  # sha256 одноразового токена PUT /feedback/{id}/logs
     submitted_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
 
 
+class FeedbackLog(Base):
+    __tablename__ = "feedback_logs"
+
+    digest = Column(String(64), primary_key=True)  # sha256 несжатых логов
+    encoding = Column(String, nullable=False)  # 'zstd' / 'gzip'
+    size = Column(Integer, nullable=False)
+    compressed_size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
 class Proposal(Base):
     __tablename__ = "proposals"
 
@@ -95,3 +118,74 @@ class ProposalVote(Base):
     __table_args__ = (
         UniqueConstraint('proposal_id', 'device_id', name='uix_proposal_device_vote'),
     )
+
+
+class JobStatus(Base):
+    __tablename__ = "job_status"
+
+    job = Column(String, primary_key=True)
+    leader = Column(String, nullable=True)  # hostname:pid текущего лидера
+    leader_since = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    last_started_at = Column(DateTime(timezone=True), nullable=True)
+    last_finished_at = Column(DateTime(timezone=True), nullable=True)
+    last_duration_seconds = Column(Float, nullable=True)
+    last_status = Column(String, nullable=True)  # 'ok' / 'error'
+    last_error = Column(Text, nullable=True)
+    watermark = Column(DateTime(timezone=True), nullable=True)  # докуда обработаны данные инкрементальной задачи
+
+
+class CheckpointStatsHistory(Base):
+    """Агрегаты рассчитанной статистики КПП по корзинам времени: '5m', '1h', '1d'."""
+    __tablename__ = "checkpoint_stats_history"
+
+    checkpoint_id = Column(Integer, ForeignKey("checkpoints.id", ondelete="CASCADE"), primary_key=True)
+    resolution = Column(String(8), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    samples = Column(Integer, nullable=False)
+    wait_sum = Column(Float, nullable=False)
+    wait_min = Column(Float, nullable=False)
+    wait_max = Column(Float, nullable=False)
+    queue_sum = Column(Float, nullable=False)
+
+
+class CheckpointForecast(Base):
+    """Профиль ожидания КПП по часам недели (UTC): массивы из 168 элементов, индекс — weekday * 24 + hour."""
+    __tablename__ = "checkpoint_forecasts"
+
+    checkpoint_id = Column(Integer, ForeignKey("checkpoints.id", ondelete="CASCADE"), primary_key=True)
+    samples = Column(ARRAY(Integer), nullable=False)
+    wait_sums = Column(ARRAY(Float), nullable=False)
+    queue_sums = Column(ARRAY(Float), nullable=False)
+    # Готовые к выдаче средние; NULL там, где опросов меньше FORECAST_MIN_SAMPLES
+    wait_avg = Column(ARRAY(Float), nullable=False)
+    queue_avg = Column(ARRAY(Float), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class ObservedCrossing(Base):
+    """Проезд через КПП, восстановленный по пингам геолокации: от подъезда до последнего пинга у поста."""
+    __tablename__ = "observed_crossings"
+
+    device_id = Column(String, primary_key=True)
+    checkpoint_id = Column(Integer, ForeignKey("checkpoints.id", ondelete="CASCADE"), primary_key=True)
+    started_at = Column(DateTime(timezone=True), primary_key=True)
+    finished_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    wait_hours = Column(Float, nullable=False)
+    recorded_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class CheckpointLiveStats(Base):
+    """Корзина оперативной статистики воркера: квантильный скетч ожидания за LIVE_STATS_BUCKET.
+
+    Скетч — разреженные корзины логарифмической шкалы: bins[i] — номер корзины, counts[i] — число опросов.
+    """
+    __tablename__ = "checkpoint_live_stats"
+
+    worker = Column(String, primary_key=True)  # hostname:pid воркера, принявшего опросы
+    checkpoint_id = Column(Integer, ForeignKey("checkpoints.id", ondelete="CASCADE"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    zero_count = Column(Integer, nullable=False)
+    bins = Column(ARRAY(Integer), nullable=False)
+    counts = Column(ARRAY(Integer), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, index=True)
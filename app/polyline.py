@@ -0,0 +1,128 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def decode(encoded: str, precision: int = 5) -> list[tuple[float, float]]:
+    """Декодирует Google Encoded Polyline в список (lat, lon)."""
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    length = len(encoded)
+
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    raise ValueError("Truncated polyline")
+                b = ord(encoded[index]) - 63
+                index += 1
+                if b < 0 or b > 63:
+                    raise ValueError("Invalid polyline character")
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+
+    return points
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    return _angular_distance(lat1, lon1, lat2, lon2) * EARTH_RADIUS_KM
+
+
+def segment_distance_km(lat: float, lon: float, a: tuple[float, float], b: tuple[float, float]) -> tuple[float, float]:
+    """Расстояние от точки до дуги большого круга a-b и смещение проекции точки от a, км."""
+    d13 = _angular_distance(a[0], a[1], lat, lon)
+    d12 = _angular_distance(a[0], a[1], b[0], b[1])
+    if d12 == 0.0 or d13 == 0.0:
+        return d13 * EARTH_RADIUS_KM, 0.0
+
+    delta = _bearing(a[0], a[1], lat, lon) - _bearing(a[0], a[1], b[0], b[1])
+    if math.cos(delta) <= 0:
+        # Проекция за началом дуги
+        return d13 * EARTH_RADIUS_KM, 0.0
+
+    dxt = math.asin(max(-1.0, min(1.0, math.sin(d13) * math.sin(delta))))
+    dat = math.acos(max(-1.0, min(1.0, math.cos(d13) / max(math.cos(dxt), 1e-12))))
+    if dat > d12:
+        # Проекция за концом дуги
+        return _angular_distance(b[0], b[1], lat, lon) * EARTH_RADIUS_KM, d12 * EARTH_RADIUS_KM
+    return abs(dxt) * EARTH_RADIUS_KM, dat * EARTH_RADIUS_KM
+
+
+def simplify(points: list[tuple[float, float]], tolerance_km: float) -> list[tuple[float, float]]:
+    """Упрощение Дугласа — Пекера: ни одна исходная точка не дальше tolerance_km от результата."""
+    if len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        max_dist, max_index = 0.0, first
+        for i in range(first + 1, last):
+            dist, _ = segment_distance_km(points[i][0], points[i][1], points[first], points[last])
+            if dist > max_dist:
+                max_dist, max_index = dist, i
+        if max_dist > tolerance_km:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+
+    return [p for p, k in zip(points, keep) if k]
+
+
+def densify(points: list[tuple[float, float]], spacing_km: float) -> tuple[list[tuple[float, float]], list[int]]:
+    """Точки вдоль линии с шагом не больше spacing_km и индекс отрезка для каждой из них."""
+    samples = []
+    segments = []
+    for i in range(len(points) - 1):
+        a, b = points[i], points[i + 1]
+        steps = max(1, math.ceil(haversine_km(a[0], a[1], b[0], b[1]) / spacing_km))
+        for step in range(steps):
+            samples.append(_interpolate(a, b, step / steps))
+            segments.append(i)
+    if points:
+        samples.append(points[-1])
+        segments.append(max(0, len(points) - 2))
+    return samples, segments
+
+
+def _angular_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    h = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dlmb = math.radians(lon2 - lon1)
+    y = math.sin(dlmb) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlmb)
+    return math.atan2(y, x)
+
+
+def _interpolate(a: tuple[float, float], b: tuple[float, float], f: float) -> tuple[float, float]:
+    """Точка на дуге большого круга a-b на доле f от a."""
+    d = _angular_distance(a[0], a[1], b[0], b[1])
+    if d == 0.0 or f == 0.0:
+        return a
+    phi1, lmb1 = math.radians(a[0]), math.radians(a[1])
+    phi2, lmb2 = math.radians(b[0]), math.radians(b[1])
+    k1 = math.sin((1 - f) * d) / math.sin(d)
+    k2 = math.sin(f * d) / math.sin(d)
+    x = k1 * math.cos(phi1) * math.cos(lmb1) + k2 * math.cos(phi2) * math.cos(lmb2)
+    y = k1 * math.cos(phi1) * math.sin(lmb1) + k2 * math.cos(phi2) * math.sin(lmb2)
+    z = k1 * math.sin(phi1) + k2 * math.sin(phi2)
+    return math.degrees(math.atan2(z, math.hypot(x, y))), math.degrees(math.atan2(y, x))
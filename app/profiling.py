@@ -0,0 +1,183 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from app.config import ADMIN_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_JOB_SAMPLE_RATE, PROFILE_OUTPUT_DIR
+from app.settings import PROFILE_SAMPLE_INTERVAL, PROFILE_MAX_STACK_DEPTH
+import hmac
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Статистический профилировщик корутин event loop.
+
+    Отдельный поток раз в PROFILE_SAMPLE_INTERVAL снимает стек потока event loop и,
+    если в этот момент выполняется профилируемая задача, засчитывает стек ей.
+    Стеки копятся по меткам (маршрут или фоновая задача) в формате collapsed stacks.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: dict[str, Counter] = {}
+        self.requests: Counter = Counter()
+        self.wall_seconds: Counter = Counter()
+        self._active: dict[asyncio.Task, Counter] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._thread: threading.Thread | None = None
+
+    def begin(self) -> asyncio.Task | None:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        with self._lock:
+            self._active[task] = Counter()
+        self._wakeup.set()
+        return task
+
+    def end(self, task: asyncio.Task, label: str, wall_seconds: float):
+        with self._lock:
+            samples = self._active.pop(task, None)
+            if samples is None:
+                return
+            self.stacks.setdefault(label, Counter()).update(samples)
+            self.requests[label] += 1
+            self.wall_seconds[label] += wall_seconds
+            if not self._active:
+                self._wakeup.clear()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            # current_task(loop) — только чтение словаря текущих задач, безопасно из другого потока под GIL
+            task = asyncio.current_task(self._loop)
+            with self._lock:
+                samples = self._active.get(task)
+                if samples is not None:
+                    samples[_collapse(frame)] += 1
+
+    def collapsed(self, label: str | None = None) -> str:
+        """Стеки в формате flamegraph.pl / speedscope: метка;кадр;кадр количество."""
+        with self._lock:
+            lines = [
+                f"{_frame_safe(name)};{stack} {count}"
+                for name, stacks in self.stacks.items()
+                if label is None or name == label
+                for stack, count in stacks.items()
+            ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def summary(self) -> dict:
+        """Сэмплы видят только время на CPU; разница с wall_seconds — ожидание БД и прочего I/O."""
+        with self._lock:
+            return {
+                label: {
+                    "requests": self.requests[label],
+                    "samples": sum(stacks.values()),
+                    "cpu_seconds": round(sum(stacks.values()) * self.interval, 3),
+                    "wall_seconds": round(self.wall_seconds[label], 3),
+                }
+                for label, stacks in self.stacks.items()
+            }
+
+    def dump(self, directory: str = PROFILE_OUTPUT_DIR) -> list[str]:
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for label in list(self.stacks):
+            path = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") + ".collapsed")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.collapsed(label))
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+            self.wall_seconds.clear()
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_qualname}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(_frame_safe(n) for n in names)
+
+
+def _frame_safe(name: str) -> str:
+    # В collapsed-формате ';' разделяет кадры, а пробел отделяет счётчик
+    return name.replace(";", ":").replace(" ", "_")
+
+
+profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL)
+
+
+def _admin_requested(headers: list[tuple[bytes, bytes]]) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    for name, value in headers:
+        if name == b"x-profile":
+            return hmac.compare_digest(value.decode("latin-1"), ADMIN_TOKEN)
+    return False
+
+
+class ProfilingMiddleware:
+    """Профилирует долю PROFILE_SAMPLE_RATE запросов и любой запрос с X-Profile: <ADMIN_TOKEN>."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE) or _admin_requested(scope["headers"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        task = profiler.begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if task is not None:
+                route = scope.get("route")
+                label = f"{scope['method']} {route.path if route is not None else 'unmatched'}"
+                profiler.end(task, label, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def profile_job(name: str):
+    """Профилирует проход фоновой задачи с вероятностью PROFILE_JOB_SAMPLE_RATE."""
+    if not PROFILE_JOB_SAMPLE_RATE or random.random() >= PROFILE_JOB_SAMPLE_RATE:
+        yield
+        return
+
+    started = time.perf_counter()
+    task = profiler.begin()
+    try:
+        yield
+    finally:
+        if task is not None:
+            profiler.end(task, f"job {name}", time.perf_counter() - started)
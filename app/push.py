@@ -0,0 +1,175 @@
+import asyncio
+from typing import AsyncIterator
+from app.metrics import GaugeCollector, register
+from app.settings import PUSH_MAX_CELLS_PER_SUBSCRIBER, SSE_KEEPALIVE_INTERVAL
+from app.snapshot import CheckpointSnapshot, get_snapshot, grid_cell, on_snapshot
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """Подписка одного клиента: набор id КПП или bbox.
+
+    Изменения не копятся очередью, а схлопываются в pending по id КПП:
+    медленный клиент получит только последнее состояние каждого КПП.
+    """
+
+    __slots__ = ("ids", "bbox", "pending", "event")
+
+    def __init__(self, ids: frozenset[int] | None, bbox: tuple[float, float, float, float] | None):
+        self.ids = ids
+        self.bbox = bbox
+        self.pending: dict[int, bytes] = {}
+        self.event = asyncio.Event()
+
+    def covers(self, lat: float, lon: float) -> bool:
+        min_lat, max_lat, min_lon, max_lon = self.bbox
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+    def push(self, checkpoint_id: int, body: bytes):
+        self.pending[checkpoint_id] = body
+        self.event.set()
+
+
+class PushHub:
+    """Раздаёт изменившиеся КПП подписчикам после каждой замены снимка.
+
+    Подписчики проиндексированы по id КПП и по ячейкам сетки снимка, поэтому
+    стоимость рассылки зависит от числа изменений и заинтересованных клиентов,
+    а не от общего числа открытых соединений.
+    """
+
+    def __init__(self):
+        self.by_id: dict[int, set[Subscriber]] = {}
+        self.by_cell: dict[tuple[int, int], set[Subscriber]] = {}
+        self.wide: set[Subscriber] = set()
+        self.count = 0
+
+    def subscribe(self, subscriber: Subscriber):
+        self.count += 1
+        if subscriber.ids is not None:
+            for checkpoint_id in subscriber.ids:
+                self.by_id.setdefault(checkpoint_id, set()).add(subscriber)
+            return
+
+        cells = self._cells(subscriber.bbox)
+        if cells is None:
+            self.wide.add(subscriber)
+            return
+        for cell in cells:
+            self.by_cell.setdefault(cell, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.count -= 1
+        if subscriber.ids is not None:
+            for checkpoint_id in subscriber.ids:
+                _discard(self.by_id, checkpoint_id, subscriber)
+            return
+
+        cells = self._cells(subscriber.bbox)
+        if cells is None:
+            self.wide.discard(subscriber)
+            return
+        for cell in cells:
+            _discard(self.by_cell, cell, subscriber)
+
+    def publish(self, snapshot: CheckpointSnapshot, positions: list[int]):
+        for pos in positions:
+            checkpoint_id = snapshot.ids[pos]
+            lat, lon = snapshot.lat[pos], snapshot.lon[pos]
+            body = snapshot.json[pos]
+
+            for subscriber in self.by_id.get(checkpoint_id, ()):
+                subscriber.push(checkpoint_id, body)
+            for subscriber in self.by_cell.get(grid_cell(lat, lon), ()):
+                if subscriber.covers(lat, lon):
+                    subscriber.push(checkpoint_id, body)
+            for subscriber in self.wide:
+                if subscriber.covers(lat, lon):
+                    subscriber.push(checkpoint_id, body)
+
+    @staticmethod
+    def _cells(bbox: tuple[float, float, float, float]) -> list[tuple[int, int]] | None:
+        min_lat, max_lat, min_lon, max_lon = bbox
+        lat_lo, lon_lo = grid_cell(min_lat, min_lon)
+        lat_hi, lon_hi = grid_cell(max_lat, max_lon)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > PUSH_MAX_CELLS_PER_SUBSCRIBER:
+            return None
+        return [(i, j) for i in range(lat_lo, lat_hi + 1) for j in range(lon_lo, lon_hi + 1)]
+
+
+def _discard(index: dict, key, subscriber: Subscriber):
+    subscribers = index.get(key)
+    if subscribers is not None:
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del index[key]
+
+
+hub = PushHub()
+
+
+def changed_positions(snapshot: CheckpointSnapshot, previous: CheckpointSnapshot | None) -> list[int]:
+    if previous is None:
+        return []
+    changed = []
+    for pos in range(len(snapshot)):
+        old = previous.get(snapshot.ids[pos])
+        if old is None or previous.json[old] != snapshot.json[pos]:
+            changed.append(pos)
+    return changed
+
+
+@on_snapshot(live=True)
+def publish_changes(snapshot: CheckpointSnapshot, previous: CheckpointSnapshot | None):
+    if not hub.count:
+        return
+    changed = changed_positions(snapshot, previous)
+    if changed:
+        hub.publish(snapshot, changed)
+        logger.info("Разосланы изменения %d КПП, подписчиков: %d", len(changed), hub.count)
+
+
+def initial_positions(subscriber: Subscriber) -> list[int]:
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return []
+    if subscriber.ids is not None:
+        return sorted(pos for pos in map(snapshot.get, subscriber.ids) if pos is not None)
+    return snapshot.query_bbox(*subscriber.bbox)
+
+
+async def sse_stream(subscriber: Subscriber) -> AsyncIterator[bytes]:
+    """Поток Server-Sent Events: сначала текущее состояние, затем только изменения."""
+    hub.subscribe(subscriber)
+    try:
+        snapshot = get_snapshot()
+        positions = initial_positions(subscriber)
+        if snapshot is not None:
+            yield _event("snapshot", [snapshot.json[pos] for pos in positions])
+
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.event.wait(), timeout=SSE_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            subscriber.event.clear()
+            pending, subscriber.pending = subscriber.pending, {}
+            if pending:
+                yield _event("update", list(pending.values()))
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def _event(name: str, fragments: list[bytes]) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: [" + b",".join(fragments) + b"]\n\n"
+
+
+register(GaugeCollector(
+    "gatemap_push_subscribers", "Открытые SSE-подписки в этом процессе", (),
+    lambda: [((), hub.count)]
+))
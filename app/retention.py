@@ -0,0 +1,236 @@
+import asyncio
+from datetime import datetime, timezone
+from sqlalchemy import delete, select, text, tuple_
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from app.db import engine
+from app.models import LocationPing
+from app.settings import (
+    LOCATION_ENTRY_TTL, LOCATION_PARTITION_INTERVAL, LOCATION_PARTITIONS_AHEAD,
+    CLEANUP_BATCH_SIZE, CLEANUP_LOCK_TIMEOUT_MS
+)
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+PINGS_TABLE = LocationPing.__tablename__
+PARTITION_PREFIX = f"{PINGS_TABLE}_p"
+
+
+def partition_start(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    return ts - (ts - datetime(2000, 1, 1, tzinfo=timezone.utc)) % LOCATION_PARTITION_INTERVAL
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARTITION_PREFIX}{start:%Y%m%d%H%M}"
+
+
+def _parse_partition(name: str) -> datetime | None:
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+async def _set_lock_timeout(conn: AsyncConnection):
+    # Обслуживание уступает вставкам: лучше пропустить проход, чем держать очередь за собой
+    await conn.execute(text(f"SET LOCAL lock_timeout = '{int(CLEANUP_LOCK_TIMEOUT_MS)}ms'"))
+
+
+def _is_lock_timeout(e: DBAPIError) -> bool:
+    return getattr(e.orig, "sqlstate", None) == "55P03"
+
+
+async def is_partitioned(conn: AsyncConnection, table: str = PINGS_TABLE) -> bool:
+    result = await conn.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table)"
+        ),
+        {"table": table}
+    )
+    return bool(result.scalar())
+
+
+async def list_partitions(conn: AsyncConnection, table: str = PINGS_TABLE) -> list[str]:
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table ORDER BY c.relname"
+        ),
+        {"table": table}
+    )
+    return list(result.scalars().all())
+
+
+async def _create_partition(conn: AsyncConnection, start: datetime):
+    end = start + LOCATION_PARTITION_INTERVAL
+    await conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(start)}" PARTITION OF "{PINGS_TABLE}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+
+async def ensure_partitions(now: datetime) -> list[str]:
+    """Создаёт секции location_pings от текущей до LOCATION_PARTITIONS_AHEAD вперёд.
+
+    Каждая секция — отдельная транзакция с lock_timeout; не созданная из-за блокировки
+    секция будет создана в следующий проход, запас вперёд это покрывает.
+    """
+    created = []
+    async with engine.connect() as conn:
+        existing = set(await list_partitions(conn))
+        await conn.commit()
+
+        # Предыдущая секция тоже: в буфере могут лежать пинги, полученные до смены часа
+        start = partition_start(now) - LOCATION_PARTITION_INTERVAL
+        for i in range(LOCATION_PARTITIONS_AHEAD + 2):
+            part_start = start + i * LOCATION_PARTITION_INTERVAL
+            name = partition_name(part_start)
+            if name in existing:
+                continue
+            try:
+                async with conn.begin():
+                    await _set_lock_timeout(conn)
+                    await _create_partition(conn, part_start)
+                created.append(name)
+            except DBAPIError as e:
+                if not _is_lock_timeout(e):
+                    raise
+                logger.warning("Секция %s не создана: таблица занята, повтор в следующий проход", name)
+                break
+    return created
+
+
+async def prepare_partitions(now: datetime) -> list[str]:
+    """Секции на запуске воркера, сразу после миграций.
+
+    На только что созданной базе иначе секций нет до первого прохода очистки у лидера,
+    и каждый COPY пингов до него падает. Несекционированную таблицу не трогает.
+    """
+    async with engine.connect() as conn:
+        partitioned = await is_partitioned(conn)
+        await conn.commit()
+    if not partitioned:
+        return []
+    return await ensure_partitions(now)
+
+
+async def drop_expired_partitions(threshold: datetime) -> list[str]:
+    """Удаляет секции location_pings, целиком лежащие до threshold, — без DELETE и VACUUM."""
+    dropped = []
+    async with engine.connect() as conn:
+        partitions = await list_partitions(conn)
+        await conn.commit()
+
+        for name in partitions:
+            start = _parse_partition(name)
+            if start is None or start + LOCATION_PARTITION_INTERVAL > threshold:
+                continue
+            try:
+                async with conn.begin():
+                    await _set_lock_timeout(conn)
+                    await conn.execute(text(f'DROP TABLE "{name}"'))
+                dropped.append(name)
+            except DBAPIError as e:
+                if not _is_lock_timeout(e):
+                    raise
+                logger.warning("Секция %s не удалена: таблица занята, повтор в следующий проход", name)
+                break
+    return dropped
+
+
+async def delete_in_batches(model, condition) -> int:
+    """Удаляет строки пачками по CLEANUP_BATCH_SIZE, каждая пачка — короткая транзакция.
+
+    При ожидании блокировки дольше CLEANUP_LOCK_TIMEOUT_MS проход прерывается,
+    остаток удалится в следующий раз.
+    """
+    pk = list(model.__table__.primary_key.columns)
+    key = pk[0] if len(pk) == 1 else tuple_(*pk)
+    total = 0
+    while True:
+        try:
+            async with engine.begin() as conn:
+                await _set_lock_timeout(conn)
+                result = await conn.execute(
+                    delete(model).where(condition, key.in_(select(*pk).where(condition).limit(CLEANUP_BATCH_SIZE)))
+                )
+        except DBAPIError as e:
+            if not _is_lock_timeout(e):
+                raise
+            logger.warning("Удаление из %s прервано: таблица занята, удалено %d", model.__tablename__, total)
+            return total
+
+        total += result.rowcount
+        if result.rowcount < CLEANUP_BATCH_SIZE:
+            return total
+        # Отдаём соединения и event loop запросам API между пачками
+        await asyncio.sleep(0)
+
+
+async def cleanup_location_pings(now: datetime) -> tuple[int, int]:
+    """Возвращает (удалённых секций, удалённых строк).
+
+    Для секционированной таблицы старые секции удаляются целиком, пачками дочищается
+    только граничная секция; несекционированная чистится пачками полностью.
+    """
+    threshold = now - LOCATION_ENTRY_TTL
+    async with engine.connect() as conn:
+        partitioned = await is_partitioned(conn)
+        await conn.commit()
+
+    dropped = []
+    if partitioned:
+        await ensure_partitions(now)
+        dropped = await drop_expired_partitions(threshold)
+    rows = await delete_in_batches(LocationPing, LocationPing.timestamp < threshold)
+    return len(dropped), rows
+
+
+async def partition_location_pings(now: datetime | None = None):
+    """Переводит существующую location_pings в секционированную по timestamp.
+
+    Всё в одной транзакции под ACCESS EXCLUSIVE: старая таблица переименовывается,
+    новая создаётся по модели, в неё переносятся пинги за LOCATION_ENTRY_TTL.
+    Запись пингов на это время ждёт лок, буфер отложенной записи повторит неудачный сброс.
+    """
+    now = now or datetime.now(timezone.utc)
+    legacy = f"{PINGS_TABLE}_legacy"
+    columns = ", ".join(f'"{c.name}"' for c in LocationPing.__table__.columns)
+
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            logger.info("Таблица %s уже секционирована", PINGS_TABLE)
+            return
+
+        await conn.execute(text(f'LOCK TABLE "{PINGS_TABLE}" IN ACCESS EXCLUSIVE MODE'))
+        await conn.execute(text(f'ALTER TABLE "{PINGS_TABLE}" RENAME TO "{legacy}"'))
+        # Имена индексов (в т.ч. первичного ключа) уникальны в схеме — освобождаем их для новой таблицы
+        indexes = await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": legacy})
+        for index in indexes.scalars().all():
+            await conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"'))
+
+        await conn.run_sync(LocationPing.__table__.create)
+
+        start = partition_start(now - LOCATION_ENTRY_TTL)
+        end = partition_start(now) + LOCATION_PARTITIONS_AHEAD * LOCATION_PARTITION_INTERVAL
+        while start <= end:
+            await _create_partition(conn, start)
+            start += LOCATION_PARTITION_INTERVAL
+
+        result = await conn.execute(
+            text(f'INSERT INTO "{PINGS_TABLE}" ({columns}) SELECT {columns} FROM "{legacy}" WHERE "timestamp" >= :since'),
+            {"since": partition_start(now - LOCATION_ENTRY_TTL)}
+        )
+        await conn.execute(text(f'DROP TABLE "{legacy}"'))
+
+    logger.info("Таблица %s секционирована, перенесено %d пингов", PINGS_TABLE, result.rowcount)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    asyncio.run(partition_location_pings())
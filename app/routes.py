@@ -1,29 +1,95 @@
-from fastapi import APIRouter, Query, Depends, HTTPException, status
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from fastapi import APIRouter, Path, Query, Depends, HTTPException, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError, DataError
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
+from pydantic import TypeAdapter
+from app.config import ADMIN_TOKEN, CHECKPOINT_SNAPSHOT_ENABLED
+from app.settings import STATS_HISTORY_RESOLUTIONS, STATS_HISTORY_MAX_POINTS, CORRIDOR_MAX_POINTS, NEAREST_MAX_K, PROPOSALS_CACHE_TTL, PUSH_MAX_SUBSCRIBERS, PUSH_MAX_IDS_PER_SUBSCRIBER
 from app.db import async_session
-from app.models import LocationPing, Checkpoint, QueueReport, Feedback, Proposal, ProposalVote
+from app.models import Checkpoint, Feedback, FeedbackLog, JobStatus, Proposal, ProposalVote
 from app.schemas import (
-    LocationData, CheckpointOut, QueueReportCreate, QueueReportOut, 
-    FeedbackCreate, ProposalOut, ProposalVoteResult, ProposalVoteCreate
+    LocationData, LocationBatch, CheckpointOut, CheckpointNearestOut, CheckpointCorridorOut, CorridorQuery, TileClusterOut, QueueReportCreate, QueueReportOut, 
+    CheckpointHistoryOut, CheckpointHistoryPoint, CheckpointForecastOut,
+    FeedbackCreate, JobStatusOut, ProposalOut, ProposalVoteResult, ProposalVoteCreate
 )
-from datetime import datetime, timezone
+from app.encoders import CHECKPOINT_FIELDS, encode, negotiate_format, ndjson_lines, ndjson_records, parse_fields
+from app.feedback_logs import LogCompressor, LogsTooLarge, decompress, hash_upload_token, new_upload_token, store_logs
+from app.forecast import fetch_forecast, hour_of_week
+from app.history import choose_resolution, fetch_history
+from app.http_cache import CachedBody, accepted_encodings, cached_response, make_etag
+from app.ingest import location_buffer, queue_report_buffer
+from app.live_stats import live_stats
+from app.metrics import render_metrics
+from app.profiling import profiler
+from app.push import Subscriber, hub, sse_stream
+from app.polyline import decode as decode_polyline
+from app.snapshot import get_snapshot
+from app.spatial import get_haversine_index
+from app.tiles import get_tile_index
+from datetime import datetime, timedelta, timezone
+import asyncio
+import hashlib
+import hmac
+import time
 import uuid
 
 
 router = APIRouter()
 
+# Тело /checkpoints выбирается и по Accept, и по Accept-Encoding — кэши должны различать оба
+VARY_NEGOTIATED = {"Vary": "Accept, Accept-Encoding"}
+
 
 @router.get("/checkpoints", response_model=list[CheckpointOut])
 async def get_checkpoints_in_bbox(
+    request: Request,
+    response: Response,
     min_lat: float = Query(..., description="Минимальная широта"),
     max_lat: float = Query(..., description="Максимальная широта"),
     min_lon: float = Query(..., description="Минимальная долгота"),
     max_lon: float = Query(..., description="Максимальная долгота"),
+    fields: str | None = Query(None, description="Поля ответа через запятую, например id,latitude,longitude,waitTimeHours"),
+    layout: str = Query("rows", pattern="^(rows|columnar)$", description="rows — список объектов, columnar — параллельные массивы"),
     db: AsyncSession = Depends(async_session)
 ):
+    started = time.perf_counter()
+    try:
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    # Формат выбирается по Accept: JSON (по умолчанию), MessagePack или потоковый NDJSON
+    fmt, media_type = negotiate_format(request)
+    snapshot = get_snapshot() if CHECKPOINT_SNAPSHOT_ENABLED else None
+
+    if snapshot is not None:
+        positions = snapshot.query_bbox(min_lat, max_lat, min_lon, max_lon)
+        timing = {"Server-Timing": _server_timing("snapshot", started), **VARY_NEGOTIATED}
+
+        if fmt == "ndjson":
+            if projection is None:
+                lines = (snapshot.json[pos] for pos in positions)
+            else:
+                lines = ndjson_records(snapshot.columns(positions, projection), projection)
+            return StreamingResponse(ndjson_lines(lines), media_type=media_type, headers=timing)
+
+        key = snapshot.list_key(positions)
+        if projection is None and fmt == "json" and layout == "rows":
+            return cached_response(request, snapshot.list_etag(key), lambda: snapshot.list_body(key, positions), headers=timing)
+
+        projection = projection or CHECKPOINT_FIELDS
+        variant = f"{fmt}:{layout}:{','.join(projection)}"
+        return cached_response(
+            request,
+            snapshot.list_etag(key, variant),
+            lambda: snapshot.cached_body(
+                (key, variant),
+                lambda: encode(snapshot.columns(positions, projection), projection, fmt, layout)
+            ),
+            headers=timing,
+            media_type=media_type
+        )
+
     stmt = select(Checkpoint).where(
         Checkpoint.lat >= min_lat,
         Checkpoint.lat <= max_lat,
@@ -31,26 +97,135 @@ async def get_checkpoints_in_bbox(
         Checkpoint.lon <= max_lon
     )
     result = await db.execute(stmt)
-    checkpoints = result.scalars().all()
+    out = [_checkpoint_out(cp) for cp in result.scalars().all()]
+
+    if projection is None and fmt == "json" and layout == "rows":
+        response.headers["Server-Timing"] = _server_timing("db", started)
+        response.headers.update(VARY_NEGOTIATED)
+        return out
+
+    projection = projection or CHECKPOINT_FIELDS
+    columns = {f: [getattr(cp, f) for cp in out] for f in projection}
+    timing = {"Server-Timing": _server_timing("db", started), **VARY_NEGOTIATED}
+    if fmt == "ndjson":
+        return StreamingResponse(ndjson_lines(ndjson_records(columns, projection)), media_type=media_type, headers=timing)
+    return Response(content=encode(columns, projection, fmt, layout), media_type=media_type, headers=timing)
+
+
+@router.get("/checkpoints/nearest", response_model=list[CheckpointNearestOut])
+async def get_nearest_checkpoints(
+    lat: float = Query(..., ge=-90, le=90, description="Широта"),
+    lon: float = Query(..., ge=-180, le=180, description="Долгота"),
+    k: int = Query(5, ge=1, le=NEAREST_MAX_K, description="Сколько ближайших КПП вернуть"),
+    max_km: float | None = Query(None, gt=0, description="Максимальное расстояние, км")
+):
+    index = await get_haversine_index()
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Checkpoint index is not ready yet"
+        )
+
+    snapshot = index.snapshot
+    return [
+        CheckpointNearestOut(**snapshot.checkpoint_out(pos).model_dump(), distanceKm=round(distance, 3))
+        for pos, distance in index.nearest(lat, lon, k, max_km)
+    ]
+
+
+@router.post("/checkpoints/corridor", response_model=list[CheckpointCorridorOut])
+async def get_checkpoints_along_route(query: CorridorQuery):
+    # Декодирование и упрощение длинной линии — чистый Python на сотни миллисекунд, не держим на нём event loop
+    try:
+        route = await asyncio.to_thread(decode_polyline, query.polyline)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid polyline: {e}")
+    if len(route) > CORRIDOR_MAX_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Polyline has more than {CORRIDOR_MAX_POINTS} points"
+        )
+
+    index = await get_haversine_index()
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Checkpoint index is not ready yet"
+        )
 
+    # Снимок берётся до ухода в поток: индекс может переключиться на новый снимок во время поиска
+    snapshot = index.snapshot
+    found = await asyncio.to_thread(index.corridor, route, query.width_km)
+    # Сначала самые быстрые КПП, при равном ожидании — ближние по маршруту
+    found.sort(key=lambda item: (snapshot.wait[item[0]], item[2]))
     return [
-        CheckpointOut(
-            id=cp.id,
-            name=cp.name,
-            latitude=cp.lat,
-            longitude=cp.lon,
-            country_from=cp.country_from,
-            country_to=cp.country_to,
-            queueSize=cp.avg_queue_size,
-            waitTimeHours=cp.avg_wait_time_hours,
-            updatedAt=cp.avg_updated_at
-        )
-        for cp in checkpoints
+        CheckpointCorridorOut(
+            **snapshot.checkpoint_out(pos).model_dump(),
+            distanceKm=round(distance, 3),
+            routeKm=round(route_km, 1)
+        )
+        for pos, distance, route_km in found[:query.limit]
     ]
 
 
+@router.get("/checkpoints/stream")
+async def stream_checkpoint_updates(
+    ids: str | None = Query(None, description="id КПП через запятую"),
+    min_lat: float | None = Query(None, description="Минимальная широта"),
+    max_lat: float | None = Query(None, description="Максимальная широта"),
+    min_lon: float | None = Query(None, description="Минимальная долгота"),
+    max_lon: float | None = Query(None, description="Максимальная долгота")
+):
+    bbox = (min_lat, max_lat, min_lon, max_lon)
+    if ids:
+        try:
+            checkpoint_ids = frozenset(int(i) for i in ids.split(",") if i.strip())
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+        if len(checkpoint_ids) > PUSH_MAX_IDS_PER_SUBSCRIBER:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {PUSH_MAX_IDS_PER_SUBSCRIBER} checkpoint ids per subscription"
+            )
+        subscriber = Subscriber(ids=checkpoint_ids, bbox=None)
+    elif None not in bbox:
+        subscriber = Subscriber(ids=None, bbox=bbox)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either ids or a full bbox (min_lat, max_lat, min_lon, max_lon) is required"
+        )
+
+    if hub.count >= PUSH_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many subscribers")
+
+    return StreamingResponse(
+        sse_stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/checkpoints/{checkpoint_id}", response_model=CheckpointOut)
-async def get_checkpoint_by_id(checkpoint_id: int, db: AsyncSession = Depends(async_session)):
+async def get_checkpoint_by_id(
+    checkpoint_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(async_session)
+):
+    started = time.perf_counter()
+    snapshot = get_snapshot() if CHECKPOINT_SNAPSHOT_ENABLED else None
+    pos = snapshot.get(checkpoint_id) if snapshot is not None else None
+
+    if pos is not None:
+        return cached_response(
+            request,
+            snapshot.item_etag(pos),
+            lambda: snapshot.item_body(pos),
+            headers={"Server-Timing": _server_timing("snapshot", started)}
+        )
+
+    # Промах по снимку: КПП мог появиться после последней перестройки
     stmt = select(Checkpoint).where(Checkpoint.id == checkpoint_id)
     result = await db.execute(stmt)
     cp = result.scalar_one_or_none()
@@ -61,58 +236,166 @@ async def get_checkpoint_by_id(checkpoint_id: int, db: AsyncSession = Depends(as
             detail=f"Checkpoint with id {checkpoint_id} not found"
         )
 
-    return CheckpointOut(
-        id=cp.id,
-        name=cp.name,
-        latitude=cp.lat,
-        longitude=cp.lon,
-        country_from=cp.country_from,
-        country_to=cp.country_to,
-        queueSize=cp.avg_queue_size,
-        waitTimeHours=cp.avg_wait_time_hours,
-        updatedAt=cp.avg_updated_at
+    response.headers["Server-Timing"] = _server_timing("db", started)
+    return _checkpoint_out(cp)
+
+
+@router.get("/checkpoints/{checkpoint_id}/history", response_model=CheckpointHistoryOut)
+async def get_checkpoint_history(
+    checkpoint_id: int,
+    start: datetime | None = Query(None, alias="from", description="Начало периода, по умолчанию сутки назад"),
+    end: datetime | None = Query(None, alias="to", description="Конец периода, по умолчанию сейчас"),
+    resolution: str | None = Query(None, pattern="^(5m|1h|1d)$", description="Уровень свёртки; по умолчанию подбирается по длине периода"),
+    session: AsyncSession = Depends(async_session)
+):
+    now = datetime.now(timezone.utc)
+    end = _as_utc(end) if end is not None else now
+    start = _as_utc(start) if start is not None else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be earlier than 'to'")
+
+    if resolution is None:
+        resolution = choose_resolution(start, end, now)
+    elif (end - start) / STATS_HISTORY_RESOLUTIONS[resolution][0] > STATS_HISTORY_MAX_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many points for resolution {resolution}: at most {STATS_HISTORY_MAX_POINTS}"
+        )
+
+    if not await checkpoint_exists(session, checkpoint_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Checkpoint with id {checkpoint_id} not found"
+        )
+
+    rows = await fetch_history(session, checkpoint_id, resolution, start, end)
+    return CheckpointHistoryOut(
+        checkpointId=checkpoint_id,
+        resolution=resolution,
+        points=[
+            CheckpointHistoryPoint(
+                time=bucket,
+                avgWaitTimeHours=round(wait_sum / samples, 2),
+                minWaitTimeHours=wait_min,
+                maxWaitTimeHours=wait_max,
+                avgQueueSize=round(queue_sum / samples, 1),
+                samples=samples
+            )
+            for bucket, samples, wait_sum, wait_min, wait_max, queue_sum in rows
+        ]
+    )
+
+
+@router.get("/checkpoints/{checkpoint_id}/forecast", response_model=CheckpointForecastOut)
+async def get_checkpoint_forecast(checkpoint_id: int, session: AsyncSession = Depends(async_session)):
+    forecast = await fetch_forecast(session, checkpoint_id)
+    if forecast is None:
+        if not await checkpoint_exists(session, checkpoint_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Checkpoint with id {checkpoint_id} not found"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No forecast for checkpoint {checkpoint_id} yet"
+        )
+
+    return CheckpointForecastOut(
+        checkpointId=checkpoint_id,
+        currentHourOfWeek=hour_of_week(datetime.now(timezone.utc)),
+        waitTimeHours=forecast.wait_avg,
+        queueSize=forecast.queue_avg,
+        samples=forecast.samples
     )
 
 
+@router.get("/tiles/{z}/{x}/{y}", response_model=list[TileClusterOut])
+async def get_checkpoint_tile(
+    request: Request,
+    z: int = Path(..., ge=0, le=22),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0)
+):
+    if x >= 1 << z or y >= 1 << z:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tile {z}/{x}/{y} does not exist"
+        )
+
+    index = await get_tile_index()
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Checkpoint tiles are not ready yet"
+        )
+
+    return cached_response(request, index.etag(z, x, y), lambda: index.body(z, x, y))
+
+
 @router.post("/location")
 async def save_location(
     data: LocationData,
     session: AsyncSession = Depends(async_session)
 ):
-    stmt = select(Checkpoint.id).where(Checkpoint.id == data.checkpoint_id)
-    result = await session.execute(stmt)
-    if result.scalar() is None:
+    if not await checkpoint_exists(session, data.checkpoint_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Checkpoint with id {data.checkpoint_id} not found"
         )
 
-    new_entry = LocationPing(
-        id=str(uuid.uuid4()),
-        device_id=data.device_id,
-        lat=data.latitude,
-        lon=data.longitude,
-        checkpoint_id=data.checkpoint_id,
-        timestamp=datetime.now(timezone.utc)
-    )
-    session.add(new_entry)
-    await session.commit()
+    received_at = datetime.now(timezone.utc)
+    await location_buffer.add([_location_row(data, received_at)])
+
+    return {
+        "status": "ok",
+        "received_at": received_at.isoformat()
+    }
+
+
+@router.post("/location/batch")
+async def save_location_batch(
+    batch: LocationBatch,
+    session: AsyncSession = Depends(async_session)
+):
+    missing = [
+        checkpoint_id
+        for checkpoint_id in sorted({p.checkpoint_id for p in batch.points})
+        if not await checkpoint_exists(session, checkpoint_id)
+    ]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Checkpoints with ids {missing} not found"
+        )
+
+    received_at = datetime.now(timezone.utc)
+    await location_buffer.add([_location_row(p, received_at) for p in batch.points])
 
     return {
         "status": "ok",
-        "received_at": new_entry.timestamp.isoformat()
+        "accepted": len(batch.points),
+        "received_at": received_at.isoformat()
     }
 
 
+@router.get("/ingest/stats")
+async def get_ingest_stats():
+    return {buffer.name: buffer.stats() for buffer in (location_buffer, queue_report_buffer)}
+
+
+@router.get("/jobs", response_model=list[JobStatusOut])
+async def get_jobs(session: AsyncSession = Depends(async_session)):
+    """Текущий лидер и тайминги последнего прохода каждой фоновой задачи."""
+    result = await session.execute(select(JobStatus).order_by(JobStatus.job))
+    return [JobStatusOut.model_validate(job, from_attributes=True) for job in result.scalars().all()]
+
+
 @router.post("/queue_report", response_model=QueueReportOut)
 async def submit_queue_report(
     report: QueueReportCreate,
     session: AsyncSession = Depends(async_session)
 ):
-    stmt = select(Checkpoint).where(Checkpoint.id == report.checkpoint_id)
-    result = await session.execute(stmt)
-    checkpoint = result.scalar_one_or_none()
-    if checkpoint is None:
+    if not await checkpoint_exists(session, report.checkpoint_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Checkpoint with id {report.checkpoint_id} not found"
@@ -120,71 +403,162 @@ async def submit_queue_report(
 
     submitted_at = datetime.now(timezone.utc)
 
-    stmt = pg_insert(QueueReport).values(
-        id=str(uuid.uuid4()),
-        checkpoint_id=report.checkpoint_id,
-        lat=report.lat,
-        lon=report.lon,
-        waiting_time_hours=report.waiting_time_hours,
-        throughput_vehicles_per_hour=report.throughput_vehicles_per_hour,
-        device_id=report.device_id,
-        submitted_at=submitted_at
-    ).on_conflict_do_update(
-        index_elements=["device_id", "checkpoint_id"],
-        set_={
-            "lat": report.lat,
-            "lon": report.lon,
-            "waiting_time_hours": report.waiting_time_hours,
-            "throughput_vehicles_per_hour": report.throughput_vehicles_per_hour,
-            "submitted_at": submitted_at
-        }
-    )
-
-    await session.execute(stmt)
-    await session.commit()
+    await queue_report_buffer.add({
+        "id": uuid.uuid4(),
+        "checkpoint_id": report.checkpoint_id,
+        "lat": report.lat,
+        "lon": report.lon,
+        "waiting_time_hours": report.waiting_time_hours,
+        "throughput_vehicles_per_hour": report.throughput_vehicles_per_hour,
+        "device_id": report.device_id,
+        "submitted_at": submitted_at
+    })
+    live_stats.record(report.checkpoint_id, report.device_id, submitted_at, report.waiting_time_hours)
 
     return QueueReportOut(submitted_at=submitted_at)
 
 
 @router.post("/feedback")
 async def submit_feedback(data: FeedbackCreate, db: AsyncSession = Depends(async_session)):
+    logs_digest = upload_token = upload_token_hash = None
+    if not data.logs:
+        # Логи можно догрузить один раз, предъявив выданный здесь токен
+        upload_token, upload_token_hash = new_upload_token()
+    else:
+        compressor = LogCompressor()
+        try:
+            # Сжатие больших логов — CPU-работа, не держим на ней event loop
+            await asyncio.to_thread(compressor.write, data.logs.encode())
+        except LogsTooLarge as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        logs_digest = await store_logs(db, compressor)
+
     new_feedback = Feedback(
         id=uuid.uuid4(),
         message=data.message,
         tag=data.tag,
         email=data.email,
-        logs=data.logs,
+        logs_digest=logs_digest,
+        logs_upload_token=upload_token_hash,
         submitted_at=datetime.now(timezone.utc)
     )
     db.add(new_feedback)
     await db.commit()
-    return {"status": "ok"}
+    response = {"status": "ok", "id": str(new_feedback.id)}
+    if upload_token is not None:
+        response["logs_upload_token"] = upload_token
+    return response
 
 
-@router.get("/proposals", response_model=list[ProposalOut])
-async def get_proposals(db: AsyncSession = Depends(async_session)):
-    stmt = select(Proposal)
+@router.put("/feedback/{feedback_id}/logs")
+async def upload_feedback_logs(
+    feedback_id: uuid.UUID,
+    request: Request,
+    db: AsyncSession = Depends(async_session)
+):
+    feedback = await db.get(Feedback, feedback_id)
+    if feedback is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Feedback with id {feedback_id} not found"
+        )
+    token = request.headers.get("x-upload-token")
+    token_hash = hash_upload_token(token) if token is not None else None
+    if feedback.logs_upload_token is None or token_hash is None or not hmac.compare_digest(token_hash, feedback.logs_upload_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Valid upload token required")
+
+    # Тело читается и сжимается по кускам, целиком в памяти держится только сжатый результат
+    compressor = LogCompressor()
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(compressor.write, chunk)
+    except LogsTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    digest = await store_logs(db, compressor)
+    # Токен гасится той же командой: из двух параллельных загрузок примется одна
+    result = await db.execute(
+        update(Feedback)
+        .where(Feedback.id == feedback_id, Feedback.logs_upload_token == token_hash)
+        .values(logs_digest=digest, logs_upload_token=None)
+    )
+    if result.rowcount == 0:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Logs have already been uploaded")
+    await db.commit()
+    return {"status": "ok", "size": compressor.size}
+
+
+@router.get("/feedback/{feedback_id}/logs")
+async def get_feedback_logs(
+    feedback_id: uuid.UUID,
+    request: Request,
+    db: AsyncSession = Depends(async_session)
+):
+    require_admin(request)
+
+    stmt = (
+        select(FeedbackLog)
+        .join(Feedback, Feedback.logs_digest == FeedbackLog.digest)
+        .where(Feedback.id == feedback_id)
+    )
     result = await db.execute(stmt)
-    proposals = result.scalars().all()
-
-    out = []
-    for p in proposals:
-        votes_stmt = select(
-            func.count().filter(ProposalVote.vote == True),
-            func.count().filter(ProposalVote.vote == False)
-        ).where(ProposalVote.proposal_id == p.id)
-        res = await db.execute(votes_stmt)
-        upvotes, downvotes = res.fetchone()
-        out.append(ProposalOut(
-            id=p.id,
-            title=p.title,
-            description=p.description,
-            created_at=p.created_at,
-            upvotes=upvotes or 0,
-            downvotes=downvotes or 0
-        ))
-
-    return out
+    log = result.scalar_one_or_none()
+    if log is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Logs for feedback {feedback_id} not found"
+        )
+
+    # Тело зависит от Accept-Encoding: у сжатого и распакованного вариантов свои ETag
+    if log.encoding == "gzip" and "gzip" in accepted_encodings(request):
+        # Клиент сам распакует gzip — отдаём сохранённые байты как есть
+        headers = {"ETag": make_etag(log.digest, "gzip"), "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        return Response(content=log.data, media_type="text/plain; charset=utf-8", headers=headers)
+
+    body = await asyncio.to_thread(decompress, log)
+    headers = {"ETag": make_etag(log.digest), "Vary": "Accept-Encoding"}
+    return Response(content=body, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@router.get("/proposals", response_model=list[ProposalOut])
+async def get_proposals(request: Request, db: AsyncSession = Depends(async_session)):
+    cache = _proposals_cache
+    now = time.monotonic()
+
+    if cache["version"] != _proposals_version or now >= cache["expires_at"]:
+        version = _proposals_version
+        stmt = (
+            select(
+                Proposal,
+                func.count().filter(ProposalVote.vote == True),
+                func.count().filter(ProposalVote.vote == False)
+            )
+            .outerjoin(ProposalVote, ProposalVote.proposal_id == Proposal.id)
+            .group_by(Proposal.id)
+            .order_by(Proposal.created_at)
+        )
+        result = await db.execute(stmt)
+
+        out = [
+            ProposalOut(
+                id=str(p.id),
+                title=p.title,
+                description=p.description,
+                created_at=p.created_at,
+                upvotes=upvotes or 0,
+                downvotes=downvotes or 0
+            )
+            for p, upvotes, downvotes in result.all()
+        ]
+        body = _proposal_list_adapter.dump_json(out)
+
+        cache["body"] = CachedBody(body)
+        cache["etag"] = make_etag(hashlib.blake2b(body, digest_size=8).hexdigest())
+        cache["version"] = version
+        cache["expires_at"] = now + PROPOSALS_CACHE_TTL
+
+    return cached_response(request, cache["etag"], lambda: cache["body"])
 
 
 @router.post("/proposals/{proposal_id}/vote", response_model=ProposalVoteResult)
@@ -212,6 +586,8 @@ async def vote_proposal(
             detail=f"Proposal with id {proposal_id} not found"
         )
 
+    _invalidate_proposals()
+
     stmt = select(
         func.count().filter(ProposalVote.vote == True),
         func.count().filter(ProposalVote.vote == False)
@@ -222,6 +598,95 @@ async def vote_proposal(
     return ProposalVoteResult(upvotes=upvotes or 0, downvotes=downvotes or 0)
 
 
+# Кэш списка предложений. Голос в этом воркере сбрасывает его сразу,
+# голоса через другие воркеры становятся видны не позже PROPOSALS_CACHE_TTL.
+_proposals_version = 0
+_proposals_cache = {"version": -1, "expires_at": 0.0, "body": None, "etag": None}
+_proposal_list_adapter = TypeAdapter(list[ProposalOut])
+
+
+def _invalidate_proposals():
+    global _proposals_version
+    _proposals_version += 1
+
+
+def require_admin(request: Request):
+    token = request.headers.get("x-admin-token")
+    if not ADMIN_TOKEN or token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+
+async def checkpoint_exists(session: AsyncSession, checkpoint_id: int) -> bool:
+    snapshot = get_snapshot() if CHECKPOINT_SNAPSHOT_ENABLED else None
+    if snapshot is not None and snapshot.get(checkpoint_id) is not None:
+        return True
+
+    stmt = select(Checkpoint.id).where(Checkpoint.id == checkpoint_id)
+    result = await session.execute(stmt)
+    return result.scalar() is not None
+
+
+def _checkpoint_out(cp: Checkpoint) -> CheckpointOut:
+    live_wait, live_wait_p90, live_reports = live_stats.estimate(cp.id, datetime.now(timezone.utc)) or (None, None, 0)
+    return CheckpointOut(
+        id=cp.id,
+        name=cp.name,
+        latitude=cp.lat,
+        longitude=cp.lon,
+        country_from=cp.country_from,
+        country_to=cp.country_to,
+        queueSize=cp.avg_queue_size,
+        waitTimeHours=cp.avg_wait_time_hours,
+        liveWaitTimeHours=live_wait,
+        liveWaitTimeP90Hours=live_wait_p90,
+        liveReports=live_reports,
+        updatedAt=cp.avg_updated_at
+    )
+
+
+def _location_row(data: LocationData, received_at: datetime) -> tuple:
+    return (uuid.uuid4(), data.device_id, data.latitude, data.longitude, received_at, data.checkpoint_id)
+
+
+def _as_utc(ts: datetime) -> datetime:
+    # Время без зоны в запросе считаем UTC
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
+
+
+def _server_timing(source: str, started: float) -> str:
+    return f"{source};dur={(time.perf_counter() - started) * 1000:.3f}"
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/debug/profile", include_in_schema=False)
+async def get_profile(request: Request, route: str | None = Query(None, description="Метка, например 'GET /checkpoints'")):
+    require_admin(request)
+    return PlainTextResponse(profiler.collapsed(route))
+
+
+@router.get("/debug/profile/summary", include_in_schema=False)
+async def get_profile_summary(request: Request):
+    require_admin(request)
+    return profiler.summary()
+
+
+@router.post("/debug/profile/dump", include_in_schema=False)
+async def dump_profile(request: Request):
+    require_admin(request)
+    return {"files": await asyncio.to_thread(profiler.dump)}
+
+
+@router.delete("/debug/profile", include_in_schema=False)
+async def reset_profile(request: Request):
+    require_admin(request)
+    profiler.reset()
+    return {"status": "ok"}
+
+
 @router.get("/", response_model=str)
 async def get_hello_world():
     return "Hello, world!"
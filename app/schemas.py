@@ -1,6 +1,10 @@
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional
 from datetime import datetime
+from app.settings import (
+    LOCATION_BATCH_MAX_POINTS, CORRIDOR_MAX_WIDTH_KM, CORRIDOR_MAX_POLYLINE_CHARS, FEEDBACK_INLINE_LOGS_MAX_CHARS,
+    QUEUE_REPORT_MAX_WAIT_HOURS, QUEUE_REPORT_MAX_THROUGHPUT
+)
 
 class LocationData(BaseModel):
     device_id: str = Field(..., max_length=64)
@@ -9,23 +13,81 @@ class LocationData(BaseModel):
     checkpoint_id: int
 
 
+class LocationBatch(BaseModel):
+    points: list[LocationData] = Field(..., min_length=1, max_length=LOCATION_BATCH_MAX_POINTS)
+
+
 class CheckpointOut(BaseModel):
     id: int
-    name: str
+    name: Optional[str] = None
     latitude: float
     longitude: float
-    country_from: str
-    country_to: str
+    country_from: Optional[str] = None
+    country_to: Optional[str] = None
     queueSize: Optional[int] = 0
     waitTimeHours: Optional[float] = 0.0
+    isForecast: bool = False
+    # Медиана и p90 ожидания по опросам за LIVE_STATS_WINDOW, обновляются без пакетного пересчёта
+    liveWaitTimeHours: Optional[float] = None
+    liveWaitTimeP90Hours: Optional[float] = None
+    liveReports: int = 0
+
+
+class CheckpointNearestOut(CheckpointOut):
+    distanceKm: float
+
+
+class CorridorQuery(BaseModel):
+    polyline: str = Field(..., min_length=1, max_length=CORRIDOR_MAX_POLYLINE_CHARS, description="Google Encoded Polyline маршрута")
+    width_km: float = Field(5.0, gt=0, le=CORRIDOR_MAX_WIDTH_KM)
+    limit: int = Field(20, ge=1, le=200)
+
+
+class CheckpointCorridorOut(CheckpointOut):
+    distanceKm: float
+    routeKm: float
+
+
+class TileClusterOut(BaseModel):
+    count: int
+    latitude: float
+    longitude: float
+    maxWaitTimeHours: float
+    avgWaitTimeHours: float
+    checkpointId: Optional[int] = None
+
+
+class CheckpointForecastOut(BaseModel):
+    """Профиль по часам недели в UTC: индекс — weekday * 24 + hour, None — мало опросов."""
+    checkpointId: int
+    currentHourOfWeek: int
+    waitTimeHours: list[Optional[float]]
+    queueSize: list[Optional[float]]
+    samples: list[int]
+
+
+class CheckpointHistoryPoint(BaseModel):
+    time: datetime
+    avgWaitTimeHours: float
+    minWaitTimeHours: float
+    maxWaitTimeHours: float
+    avgQueueSize: float
+    samples: int
+
+
+class CheckpointHistoryOut(BaseModel):
+    checkpointId: int
+    resolution: str
+    points: list[CheckpointHistoryPoint]
 
 
 class QueueReportCreate(BaseModel):
-    checkpoint_id: int
-    lat: float
-    lon: float
-    waiting_time_hours: float
-    throughput_vehicles_per_hour: int
+    # Границы как у столбцов queue_reports: иначе опрос примется с 200, а в БД его отклонят при сбросе буфера
+    checkpoint_id: int = Field(..., ge=1, le=2**31 - 1)
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+    waiting_time_hours: float = Field(..., ge=0, le=QUEUE_REPORT_MAX_WAIT_HOURS, allow_inf_nan=False)
+    throughput_vehicles_per_hour: int = Field(..., ge=0, le=QUEUE_REPORT_MAX_THROUGHPUT)
     device_id: str
 
 
@@ -46,7 +108,8 @@ class FeedbackCreate(BaseModel):
     message: str
     tag: str
     email: EmailStr | None = None
-    logs: str
+    # Большие логи загружаются потоком через PUT /feedback/{id}/logs
+    logs: str | None = Field(None, max_length=FEEDBACK_INLINE_LOGS_MAX_CHARS)
 
 
 class ProposalVoteCreate(BaseModel):
@@ -57,3 +120,15 @@ class ProposalVoteCreate(BaseModel):
 class ProposalVoteResult(BaseModel):
     upvotes: int
     downvotes: int
+
+
+class JobStatusOut(BaseModel):
+    job: str
+    leader: str | None = None
+    leader_since: datetime | None = None
+    heartbeat_at: datetime | None = None
+    last_started_at: datetime | None = None
+    last_finished_at: datetime | None = None
+    last_duration_seconds: float | None = None
+    last_status: str | None = None
+    last_error: str | None = None
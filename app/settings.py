@@ -3,4 +3,95 @@ from datetime import timedelta
 LOCATION_ENTRY_TTL = timedelta(days=1)
 QUEUE_REPORT_TTL = timedelta(days=1)
 CLEANUP_INTERVAL = 60 * 30
-STATS_REFRESH_TTL = 60 * 10
\ No newline at end of file
+STATS_REFRESH_TTL = 60 * 10
+SNAPSHOT_GRID_CELL_DEG = 0.5
+
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_COMPRESS_MIN_BYTES = 512
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5
+
+LOCATION_BATCH_MAX_POINTS = 500
+LOCATION_BUFFER_MAX_ROWS = 1000
+LOCATION_BUFFER_FLUSH_INTERVAL = 2.0
+LOCATION_BUFFER_MAX_PENDING = 50_000
+
+QUEUE_BUFFER_MAX_ROWS = 1000
+QUEUE_BUFFER_FLUSH_INTERVAL = 5.0
+QUEUE_BUFFER_MAX_PENDING = 20_000
+QUEUE_REPORT_MAX_WAIT_HOURS = 240.0
+QUEUE_REPORT_MAX_THROUGHPUT = 10_000
+
+PROPOSALS_CACHE_TTL = 15
+
+TILE_MAX_ZOOM = 12
+TILE_CLUSTER_GRID_BITS = 3
+
+NDJSON_CHUNK_ROWS = 500
+
+PUSH_MAX_SUBSCRIBERS = 50_000
+PUSH_MAX_IDS_PER_SUBSCRIBER = 500
+PUSH_MAX_CELLS_PER_SUBSCRIBER = 400
+SSE_KEEPALIVE_INTERVAL = 25
+
+NEAREST_MAX_K = 50
+
+CORRIDOR_MAX_POINTS = 20_000
+# Точка кодированной линии — не больше 12 символов (два приращения по 6)
+CORRIDOR_MAX_POLYLINE_CHARS = CORRIDOR_MAX_POINTS * 12
+CORRIDOR_MAX_SAMPLES = 20_000
+CORRIDOR_MAX_WIDTH_KM = 50.0
+CORRIDOR_SIMPLIFY_RATIO = 0.25
+
+FEEDBACK_LOGS_MAX_BYTES = 5 * 1024 * 1024
+FEEDBACK_LOGS_ZSTD_LEVEL = 6
+FEEDBACK_LOGS_GZIP_LEVEL = 6
+FEEDBACK_INLINE_LOGS_MAX_CHARS = 64 * 1024
+FEEDBACK_LOGS_ORPHAN_TTL = timedelta(days=1)
+
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_STACK_DEPTH = 128
+
+MIGRATION_LOCK_KEY = 7_420_001
+
+LEADER_RETRY_INTERVAL = 15
+LEADER_HEARTBEAT_INTERVAL = 15
+SNAPSHOT_POLL_INTERVAL = 30
+STATS_WATERMARK_LAG = timedelta(minutes=2)
+STATS_MIN_REPORTS = 5
+# Строк в одном VALUES: у PostgreSQL не больше 65535 параметров на запрос
+STATS_WRITE_CHUNK = 5000
+
+LOCATION_PARTITION_INTERVAL = timedelta(hours=1)
+LOCATION_PARTITIONS_AHEAD = 24
+CLEANUP_BATCH_SIZE = 5000
+CLEANUP_LOCK_TIMEOUT_MS = 2000
+
+# Разрешение истории статистики КПП: (размер корзины, срок хранения)
+STATS_HISTORY_RESOLUTIONS = {
+    "5m": (timedelta(minutes=5), timedelta(days=2)),
+    "1h": (timedelta(hours=1), timedelta(days=30)),
+    "1d": (timedelta(days=1), timedelta(days=730)),
+}
+STATS_HISTORY_MAX_POINTS = 500
+
+FORECAST_REFRESH_INTERVAL = 60 * 10
+FORECAST_MIN_SAMPLES = 3
+
+# Разметка пингов на проезды через КПП
+CROSSING_APPROACH_KM = 15.0
+CROSSING_DWELL_KM = 0.5
+CROSSING_EXIT_KM = 1.0
+CROSSING_SESSION_TIMEOUT = timedelta(hours=2)
+CROSSING_MAX_DURATION = timedelta(hours=12)
+CROSSING_MAX_SESSIONS = 200_000
+CROSSING_READ_CHUNK = 5000
+CROSSING_REFRESH_INTERVAL = 60
+
+# Оперативная статистика КПП по опросам, принятым воркерами
+LIVE_STATS_WINDOW = timedelta(hours=1)
+LIVE_STATS_BUCKET = timedelta(minutes=5)
+LIVE_STATS_ACCURACY = 0.02  # относительная погрешность квантилей
+LIVE_STATS_MIN_VALUE = 0.01  # часов; меньшие значения считаются нулём
+LIVE_STATS_MIN_REPORTS = 3
+LIVE_STATS_SYNC_INTERVAL = 15
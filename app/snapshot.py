@@ -0,0 +1,377 @@
+import asyncio
+import copy
+import hashlib
+import math
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable
+from sqlalchemy import func, select
+from app.db import AsyncSessionLocal
+from app.http_cache import CachedBody, make_etag
+from app.metrics import GaugeCollector, register
+from app.forecast import hour_of_week
+from app.models import Checkpoint, CheckpointForecast
+from app.schemas import CheckpointOut
+from app.settings import SNAPSHOT_GRID_CELL_DEG, RESPONSE_CACHE_SIZE, SNAPSHOT_POLL_INTERVAL
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointSnapshot:
+    """Неизменяемый снимок таблицы checkpoints с равномерной сеткой по lat/lon.
+
+    Данные лежат в параллельных массивах, позиция в массиве — внутренний индекс КПП.
+    Снимок никогда не меняется после построения: обновление — это замена целиком.
+    """
+
+    def __init__(self, rows, version: int, forecast_hour: int, live: dict[int, tuple[float, float, int]], live_digest: str):
+        self.version = version
+        self.forecast_hour = forecast_hour
+        self.live = live
+        self.ids = array("q")
+        self.lat = array("d")
+        self.lon = array("d")
+        self.wait = array("d")
+        self.queue = array("q")
+        self.names: list[str | None] = []
+        self.country_from: list[str | None] = []
+        self.country_to: list[str | None] = []
+        self.updated_at: list[datetime] = []
+        self.is_forecast: list[bool] = []
+        self.live_wait: list[float | None] = []
+        self.live_wait_p90: list[float | None] = []
+        self.live_reports: list[int] = []
+        self.index_by_id: dict[int, int] = {}
+        self.grid: dict[tuple[int, int], array] = {}
+        self.stats_updated_at: datetime | None = None
+        self.forecast_updated_at: datetime | None = None
+
+        for pos, row in enumerate(rows):
+            (cp_id, name, lat, lon, country_from, country_to, wait, queue, updated_at,
+             stats_fresh, forecast_wait, forecast_queue, forecast_updated_at) = row
+            # Без свежей статистики показываем прогноз на текущий час недели, если он есть
+            is_forecast = not stats_fresh and forecast_wait is not None
+            if is_forecast:
+                wait, queue = forecast_wait, int(forecast_queue)
+            self.ids.append(cp_id)
+            self.lat.append(lat)
+            self.lon.append(lon)
+            self.wait.append(wait)
+            self.queue.append(queue)
+            self.is_forecast.append(is_forecast)
+            live_wait, live_wait_p90, live_reports = live.get(cp_id, (None, None, 0))
+            self.live_wait.append(live_wait)
+            self.live_wait_p90.append(live_wait_p90)
+            self.live_reports.append(live_reports)
+            self.names.append(name)
+            self.country_from.append(country_from)
+            self.country_to.append(country_to)
+            self.updated_at.append(updated_at)
+            self.index_by_id[cp_id] = pos
+            self.grid.setdefault(grid_cell(lat, lon), array("I")).append(pos)
+            if self.stats_updated_at is None or updated_at > self.stats_updated_at:
+                self.stats_updated_at = updated_at
+            if forecast_updated_at is not None and (
+                self.forecast_updated_at is None or forecast_updated_at > self.forecast_updated_at
+            ):
+                self.forecast_updated_at = forecast_updated_at
+
+        # Версия статистики выводится из avg_updated_at, версии прогнозов и часа недели
+        # и служит ключом всех готовых ответов; к ней добавляется хэш оперативных оценок.
+        # Всё выводится из содержимого, поэтому у всех воркеров ETag одинаковые.
+        stats_ts = int(self.stats_updated_at.timestamp() * 1_000_000) if self.stats_updated_at else 0
+        forecast_ts = int(self.forecast_updated_at.timestamp()) if self.forecast_updated_at else 0
+        self.base_version = f"{stats_ts:x}.{len(self.ids):x}.{forecast_ts:x}.{forecast_hour:x}"
+        self.stats_version = f"{self.base_version}.{live_digest}"
+
+        self.json: list[bytes] = [self.checkpoint_out(pos).model_dump_json().encode() for pos in range(len(self.ids))]
+        self._item_bodies: dict[int, CachedBody] = {}
+        self._list_bodies: OrderedDict[object, CachedBody] = OrderedDict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def with_live(self, live: dict[int, tuple[float, float, int]], live_digest: str, version: int) -> "CheckpointSnapshot":
+        """Копия снимка с другими оперативными оценками.
+
+        Пересобираются только колонки оперативной статистики и JSON изменившихся КПП;
+        строки, координаты и сетка общие с исходным снимком.
+        """
+        snapshot = copy.copy(self)
+        snapshot.version = version
+        snapshot.live = live
+        snapshot.live_wait = list(self.live_wait)
+        snapshot.live_wait_p90 = list(self.live_wait_p90)
+        snapshot.live_reports = list(self.live_reports)
+        snapshot.json = list(self.json)
+        snapshot.stats_version = f"{self.base_version}.{live_digest}"
+
+        changed = set()
+        for cp_id in self.live.keys() | live.keys():
+            pos = self.index_by_id.get(cp_id)
+            if pos is None or self.live.get(cp_id) == live.get(cp_id):
+                continue
+            snapshot.live_wait[pos], snapshot.live_wait_p90[pos], snapshot.live_reports[pos] = live.get(cp_id, (None, None, 0))
+            snapshot.json[pos] = snapshot.checkpoint_out(pos).model_dump_json().encode()
+            changed.add(pos)
+
+        snapshot._item_bodies = {pos: body for pos, body in self._item_bodies.items() if pos not in changed}
+        snapshot._list_bodies = OrderedDict()
+        return snapshot
+
+    def get(self, checkpoint_id: int) -> int | None:
+        return self.index_by_id.get(checkpoint_id)
+
+    def checkpoint_out(self, pos: int) -> CheckpointOut:
+        return CheckpointOut(
+            id=self.ids[pos],
+            name=self.names[pos],
+            latitude=self.lat[pos],
+            longitude=self.lon[pos],
+            country_from=self.country_from[pos],
+            country_to=self.country_to[pos],
+            queueSize=self.queue[pos],
+            waitTimeHours=self.wait[pos],
+            isForecast=self.is_forecast[pos],
+            liveWaitTimeHours=self.live_wait[pos],
+            liveWaitTimeP90Hours=self.live_wait_p90[pos],
+            liveReports=self.live_reports[pos],
+            updatedAt=self.updated_at[pos]
+        )
+
+    def item_etag(self, pos: int) -> str:
+        if self.is_forecast[pos]:
+            return make_etag(self.stats_version, self.ids[pos])
+        base = f"{int(self.updated_at[pos].timestamp() * 1_000_000):x}"
+        if not self.live_reports[pos]:
+            return make_etag(base, self.ids[pos])
+        return make_etag(base, self.ids[pos], f"{self.live_reports[pos]:x}:{self.live_wait[pos]}:{self.live_wait_p90[pos]}")
+
+    def item_body(self, pos: int) -> CachedBody:
+        cached = self._item_bodies.get(pos)
+        if cached is None:
+            cached = self._item_bodies[pos] = CachedBody(self.json[pos])
+        return cached
+
+    def list_key(self, positions: list[int]) -> bytes:
+        return hashlib.blake2b(array("I", positions).tobytes(), digest_size=8).digest()
+
+    def list_etag(self, key: bytes, variant: str = "") -> str:
+        if not variant:
+            return make_etag(self.stats_version, key.hex())
+        return make_etag(self.stats_version, key.hex(), hashlib.blake2b(variant.encode(), digest_size=4).hexdigest())
+
+    def list_body(self, key: bytes, positions: list[int]) -> CachedBody:
+        fragments = self.json
+        return self.cached_body(key, lambda: b"[" + b",".join(fragments[pos] for pos in positions) + b"]")
+
+    def cached_body(self, cache_key, build: Callable[[], bytes]) -> CachedBody:
+        cached = self._list_bodies.get(cache_key)
+        if cached is not None:
+            self._list_bodies.move_to_end(cache_key)
+            return cached
+
+        cached = self._list_bodies[cache_key] = CachedBody(build())
+        if len(self._list_bodies) > RESPONSE_CACHE_SIZE:
+            self._list_bodies.popitem(last=False)
+        return cached
+
+    def columns(self, positions: list[int], fields: tuple[str, ...]) -> dict[str, list]:
+        sources = {
+            "id": self.ids,
+            "name": self.names,
+            "latitude": self.lat,
+            "longitude": self.lon,
+            "country_from": self.country_from,
+            "country_to": self.country_to,
+            "queueSize": self.queue,
+            "waitTimeHours": self.wait,
+            "isForecast": self.is_forecast,
+            "liveWaitTimeHours": self.live_wait,
+            "liveWaitTimeP90Hours": self.live_wait_p90,
+            "liveReports": self.live_reports,
+        }
+        return {f: [sources[f][pos] for pos in positions] for f in fields}
+
+    def query_bbox(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> list[int]:
+        if min_lat > max_lat or min_lon > max_lon:
+            return []
+
+        lat_lo, lon_lo = grid_cell(min_lat, min_lon)
+        lat_hi, lon_hi = grid_cell(max_lat, max_lon)
+        cells_in_bbox = (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1)
+
+        # Для больших bbox дешевле пройти по непустым ячейкам, чем по всем ячейкам прямоугольника
+        if cells_in_bbox > len(self.grid):
+            buckets = (
+                bucket for (i, j), bucket in self.grid.items()
+                if lat_lo <= i <= lat_hi and lon_lo <= j <= lon_hi
+            )
+        else:
+            buckets = (
+                self.grid[(i, j)]
+                for i in range(lat_lo, lat_hi + 1)
+                for j in range(lon_lo, lon_hi + 1)
+                if (i, j) in self.grid
+            )
+
+        lat, lon = self.lat, self.lon
+        result = [
+            pos
+            for bucket in buckets
+            for pos in bucket
+            if min_lat <= lat[pos] <= max_lat and min_lon <= lon[pos] <= max_lon
+        ]
+        result.sort()
+        return result
+
+
+def live_digest(live: dict[int, tuple[float, float, int]]) -> str:
+    return hashlib.blake2b(repr(sorted(live.items())).encode(), digest_size=6).hexdigest()
+
+
+def grid_cell(lat: float, lon: float) -> tuple[int, int]:
+    return math.floor(lat / SNAPSHOT_GRID_CELL_DEG), math.floor(lon / SNAPSHOT_GRID_CELL_DEG)
+
+
+_current: CheckpointSnapshot | None = None
+_version = 0
+_live: dict[int, tuple[float, float, int]] = {}
+_live_digest = live_digest({})
+_listeners: list[tuple[Callable[[CheckpointSnapshot, CheckpointSnapshot | None], None], bool]] = []
+
+
+def get_snapshot() -> CheckpointSnapshot | None:
+    return _current
+
+
+def on_snapshot(listener: Callable[[CheckpointSnapshot, CheckpointSnapshot | None], None] | None = None, *, live: bool = False):
+    """Регистрирует построитель производных структур, вызываемый после каждой замены снимка.
+
+    live=True — вызывать и при обновлении одной оперативной статистики (with_live);
+    структурам, не зависящим от неё (тайлы, индекс ближайших), это не нужно.
+    """
+    if listener is None:
+        return lambda func: on_snapshot(func, live=live)
+    _listeners.append((listener, live))
+    return listener
+
+
+async def refresh_snapshot() -> CheckpointSnapshot:
+    global _version
+
+    started = time.perf_counter()
+    hour = hour_of_week(datetime.now(timezone.utc))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(
+                Checkpoint.id,
+                Checkpoint.name,
+                Checkpoint.lat,
+                Checkpoint.lon,
+                Checkpoint.country_from,
+                Checkpoint.country_to,
+                Checkpoint.avg_wait_time_hours,
+                Checkpoint.avg_queue_size,
+                Checkpoint.avg_updated_at,
+                Checkpoint.stats_fresh,
+                # Массивы PostgreSQL нумеруются с 1
+                CheckpointForecast.wait_avg[hour + 1],
+                CheckpointForecast.queue_avg[hour + 1],
+                CheckpointForecast.updated_at,
+            )
+            .outerjoin(CheckpointForecast, CheckpointForecast.checkpoint_id == Checkpoint.id)
+            .order_by(Checkpoint.id)
+            .execution_options(query_name="snapshot_refresh")
+        )
+        rows = result.all()
+
+    _version += 1
+    snapshot = CheckpointSnapshot(rows, _version, hour, _live, _live_digest)
+    _install(snapshot)
+
+    logger.info(
+        "Снимок КПП v%d перестроен: %d КПП, %d ячеек сетки за %.1f мс",
+        snapshot.version, len(snapshot), len(snapshot.grid), (time.perf_counter() - started) * 1000
+    )
+    return snapshot
+
+
+def publish_live(live: dict[int, tuple[float, float, int]]):
+    """Подставляет в снимок новые оперативные оценки: (медиана, p90, число опросов) по КПП.
+
+    БД не читается, снимок не перестраивается: меняются только оперативные колонки и JSON
+    изменившихся КПП, а тайлы и индекс ближайших КПП остаются прежними.
+    """
+    global _version, _live, _live_digest
+
+    digest = live_digest(live)
+    if digest == _live_digest:
+        return
+    _live, _live_digest = live, digest
+    if _current is None:
+        return
+    _version += 1
+    _install(_current.with_live(_live, _live_digest, _version), live_only=True)
+    logger.debug("Снимок КПП v%d: обновлена оперативная статистика %d КПП", _version, len(live))
+
+
+def _install(snapshot: CheckpointSnapshot, live_only: bool = False):
+    global _current
+
+    # Замена ссылки атомарна: читатели видят либо старый, либо новый снимок целиком
+    previous, _current = _current, snapshot
+
+    for listener, live in _listeners:
+        if live_only and not live:
+            continue
+        try:
+            listener(snapshot, previous)
+        except Exception as e:
+            logger.exception("Ошибка построения производных данных снимка в %s: %s", listener.__qualname__, e)
+
+
+async def watch_snapshot():
+    """Перестраивает снимок, когда статистику или прогнозы обновил лидер задачи в другом процессе.
+
+    Работает в каждом воркере: дешёвый запрос max(avg_updated_at), count(*) и версии прогнозов
+    сравнивается с текущим снимком, полная выборка делается только при расхождении
+    или со сменой часа недели (прогноз берётся на текущий час).
+    """
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(
+                    func.max(Checkpoint.avg_updated_at),
+                    func.count(Checkpoint.id),
+                    select(func.max(CheckpointForecast.updated_at)).scalar_subquery()
+                ).execution_options(query_name="snapshot_poll"))
+                updated_at, count, forecast_updated_at = result.one()
+
+            snapshot = _current
+            if (
+                snapshot is None
+                or snapshot.stats_updated_at != updated_at
+                or len(snapshot) != count
+                or snapshot.forecast_updated_at != forecast_updated_at
+                or snapshot.forecast_hour != hour_of_week(datetime.now(timezone.utc))
+            ):
+                await refresh_snapshot()
+        except Exception as e:
+            logger.exception("Ошибка проверки актуальности снимка КПП: %s", e)
+
+        await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+
+
+register(GaugeCollector(
+    "gatemap_snapshot_checkpoints", "КПП в снимке в памяти", (),
+    lambda: [((), len(_current))] if _current is not None else []
+))
+register(GaugeCollector(
+    "gatemap_snapshot_version", "Номер текущего снимка КПП в этом процессе", (),
+    lambda: [((), _current.version)] if _current is not None else []
+))
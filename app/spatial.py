@@ -0,0 +1,147 @@
+import asyncio
+import math
+import time
+from app.polyline import EARTH_RADIUS_KM, densify, haversine_km, segment_distance_km, simplify
+from app.settings import CORRIDOR_SIMPLIFY_RATIO, CORRIDOR_MAX_SAMPLES
+from app.snapshot import CheckpointSnapshot, get_snapshot, on_snapshot
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class HaversineIndex:
+    """BallTree с метрикой haversine по координатам КПП из снимка.
+
+    Координаты КПП меняются только при загрузке новых КПП, поэтому дерево
+    переиспользуется между снимками, пока набор точек тот же. Строится лениво,
+    при первом запросе ближайших КПП или коридора, в отдельном потоке.
+    """
+
+    def __init__(self, snapshot: CheckpointSnapshot):
+        # numpy и scikit-learn грузятся при первой сборке индекса, а не при импорте app.main
+        import numpy as np
+        from sklearn.neighbors import BallTree
+
+        self.snapshot = snapshot
+        self.geometry = snapshot_geometry(snapshot)
+        points = np.radians(np.column_stack([np.frombuffer(snapshot.lat), np.frombuffer(snapshot.lon)]))
+        self.tree = BallTree(points, metric="haversine") if len(snapshot) else None
+
+    def nearest(self, lat: float, lon: float, k: int, max_km: float | None = None) -> list[tuple[int, float]]:
+        """Возвращает до k пар (позиция в снимке, расстояние в км), по возрастанию расстояния."""
+        import numpy as np
+
+        if self.tree is None:
+            return []
+        point = np.radians([[lat, lon]])
+        distances, indices = self.tree.query(point, k=min(k, len(self.snapshot)))
+        result = [(int(pos), float(dist) * EARTH_RADIUS_KM) for dist, pos in zip(distances[0], indices[0])]
+        if max_km is not None:
+            result = [(pos, dist) for pos, dist in result if dist <= max_km]
+        return result
+
+    def corridor(self, route: list[tuple[float, float]], width_km: float) -> list[tuple[int, float, float]]:
+        """КПП не дальше width_km от маршрута: тройки (позиция, расстояние до маршрута, км от начала).
+
+        Маршрут упрощается с допуском CORRIDOR_SIMPLIFY_RATIO * width_km, затем вдоль него
+        расставляются точки с шагом около width_km, и кандидаты берутся одним запросом
+        query_radius по всем точкам сразу. Точное расстояние считается до дуг упрощённой линии.
+        """
+        import numpy as np
+
+        if self.tree is None or not route:
+            return []
+
+        simplified = simplify(route, width_km * CORRIDOR_SIMPLIFY_RATIO)
+        if len(simplified) == 1:
+            simplified = simplified * 2
+
+        lengths = [haversine_km(a[0], a[1], b[0], b[1]) for a, b in zip(simplified, simplified[1:])]
+        spacing = max(width_km, sum(lengths) / CORRIDOR_MAX_SAMPLES)
+        samples, sample_segments = densify(simplified, spacing)
+
+        # Точка в коридоре не дальше hypot(width, spacing / 2) от ближайшей точки выборки
+        radius_km = math.hypot(width_km, spacing / 2) * 1.01
+        points = np.radians(np.array(samples))
+        neighbours = self.tree.query_radius(points, r=radius_km / EARTH_RADIUS_KM)
+
+        candidates: dict[int, set[int]] = {}
+        for segment, positions in zip(sample_segments, neighbours):
+            for pos in positions:
+                candidates.setdefault(int(pos), set()).add(segment)
+
+        offsets = [0.0]
+        for length in lengths:
+            offsets.append(offsets[-1] + length)
+
+        result = []
+        lat, lon = self.snapshot.lat, self.snapshot.lon
+        for pos, segments in candidates.items():
+            best = None
+            for segment in segments:
+                for i in (segment - 1, segment, segment + 1):
+                    if 0 <= i < len(lengths):
+                        dist, along = segment_distance_km(lat[pos], lon[pos], simplified[i], simplified[i + 1])
+                        if best is None or dist < best[0]:
+                            best = (dist, offsets[i] + along)
+            if best is not None and best[0] <= width_km:
+                result.append((pos, best[0], best[1]))
+
+        result.sort(key=lambda item: item[2])
+        return result
+
+
+def snapshot_geometry(snapshot: CheckpointSnapshot) -> bytes:
+    return snapshot.ids.tobytes() + snapshot.lat.tobytes() + snapshot.lon.tobytes()
+
+
+_index: HaversineIndex | None = None
+_building: asyncio.Task | None = None
+
+
+@on_snapshot(live=True)
+def invalidate_haversine_index(snapshot: CheckpointSnapshot, previous: CheckpointSnapshot | None):
+    global _index
+    if _index is None:
+        return
+    # Снимок с новой оперативной статистикой делит массивы координат с прежним
+    if _index.snapshot.ids is snapshot.ids or _index.geometry == snapshot_geometry(snapshot):
+        # Точки те же: меняем только снимок, из которого берутся значения статистики
+        _index.snapshot = snapshot
+    else:
+        _index = None
+
+
+async def build_haversine_index():
+    global _index
+    while _index is None:
+        snapshot = get_snapshot()
+        started = time.perf_counter()
+        index = await asyncio.to_thread(HaversineIndex, snapshot)
+        current = get_snapshot()
+        if index.geometry != snapshot_geometry(current):
+            # За время сборки сменился набор точек: собрать заново по новому снимку
+            continue
+        index.snapshot = current
+        _index = index
+        logger.info(
+            "Индекс ближайших КПП построен: %d точек за %.1f мс",
+            len(snapshot), (time.perf_counter() - started) * 1000
+        )
+
+
+async def get_haversine_index() -> HaversineIndex | None:
+    global _building
+    if get_snapshot() is None:
+        return None
+    if _index is None:
+        if _building is None or _building.done():
+            _building = asyncio.create_task(build_haversine_index())
+        try:
+            # Сборку ждут все запросы сразу; обрыв одного из них её не отменяет
+            await asyncio.shield(_building)
+        except Exception as e:
+            logger.exception("Ошибка построения индекса ближайших КПП: %s", e)
+            return None
+    return _index
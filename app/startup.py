@@ -0,0 +1,45 @@
+import sys
+import time
+from contextlib import contextmanager
+from app.metrics import GaugeCollector, register
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ("numpy", "pandas", "sklearn", "scipy")
+
+
+class StartupReport:
+    """Куда уходит время запуска воркера: импорты, миграции, старт фоновых задач."""
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def log(self):
+        heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+        logger.info(
+            "Запуск воркера за %.0f мс: %s; тяжёлые модули при старте: %s",
+            sum(self.phases.values()) * 1000,
+            ", ".join(f"{name}={seconds * 1000:.0f} мс" for name, seconds in self.phases.items()),
+            ", ".join(heavy) or "нет"
+        )
+
+
+startup_report = StartupReport()
+
+register(GaugeCollector(
+    "gatemap_startup_phase_seconds", "Длительность фаз запуска воркера", ("phase",),
+    lambda: [((name,), seconds) for name, seconds in startup_report.phases.items()]
+))
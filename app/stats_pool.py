@@ -0,0 +1,43 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+from app.config import STATS_WORKER_PROCESSES
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: родитель — процесс с event loop и потоками (профилировщик, пул БД)
+        _pool = ProcessPoolExecutor(max_workers=STATS_WORKER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        logger.info("Запущен пул расчёта статистики: %d процесс(ов)", STATS_WORKER_PROCESSES)
+    return _pool
+
+
+async def run_cpu_bound(func: Callable, *args):
+    """Выполняет func вне event loop: в пуле процессов или, при STATS_WORKER_PROCESSES=0, в потоке.
+
+    Пул создаётся при первом вызове, то есть только у воркера-лидера задачи статистики.
+    """
+    if STATS_WORKER_PROCESSES <= 0:
+        return await asyncio.to_thread(func, *args)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), func, *args)
+    except BrokenProcessPool:
+        # Процесс пула упал; следующий вызов создаст пул заново
+        shutdown_pool()
+        raise
+
+
+def shutdown_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,11 +1,18 @@
-import asyncio
 from datetime import datetime, timezone
-import pandas as pd
-from sklearn.cluster import KMeans
-from sqlalchemy import select, delete, update
-from app.models import LocationPing, QueueReport, Checkpoint
+from sqlalchemy import Float, Integer, and_, column, exists, or_, select, update, values
+from app.models import QueueReport, Checkpoint, CheckpointLiveStats, Feedback, FeedbackLog, ObservedCrossing
+from app.crossings import CROSSINGS_JOB, process_new_pings
 from app.db import AsyncSessionLocal
-from app.settings import LOCATION_ENTRY_TTL, QUEUE_REPORT_TTL, CLEANUP_INTERVAL, STATS_REFRESH_TTL
+from app.forecast import FORECAST_JOB, apply_new_reports
+from app.history import cleanup_history, record_stats
+from app.leader import run_periodic
+from app.retention import cleanup_location_pings, delete_in_batches
+from app.snapshot import refresh_snapshot
+from app.settings import (
+    LOCATION_ENTRY_TTL, QUEUE_REPORT_TTL, CLEANUP_INTERVAL, STATS_REFRESH_TTL, STATS_WATERMARK_LAG,
+    FORECAST_REFRESH_INTERVAL, CROSSING_REFRESH_INTERVAL, LIVE_STATS_WINDOW, FEEDBACK_LOGS_ORPHAN_TTL,
+    STATS_WRITE_CHUNK
+)
 from collections import defaultdict
 import logging
 
@@ -14,99 +21,245 @@ logger = logging.getLogger(__name__)
 
 
 async def cleanup_old_data():
-    while True:
-        try:
-            async with AsyncSessionLocal() as session:
-                now = datetime.now(timezone.utc)
-                location_threshold = now - LOCATION_ENTRY_TTL
-                queue_threshold = now - QUEUE_REPORT_TTL
+    await run_periodic("cleanup_old_data", CLEANUP_INTERVAL, cleanup_old_data_once, "Ошибка при очистке устаревших данных: %s")
 
-                # Удаление старых LocationPing
-                loc_del_stmt = delete(LocationPing).where(LocationPing.timestamp < location_threshold)
-                loc_result = await session.execute(loc_del_stmt)
-                logger.info("Удалены старые координаты старше %s", location_threshold)
 
-                # Удаление старых QueueReport
-                queue_del_stmt = delete(QueueReport).where(QueueReport.submitted_at < queue_threshold)
-                queue_result = await session.execute(queue_del_stmt)
-                logger.info("Удалены старые опросы старше %s", queue_threshold)
+async def update_checkpoint_stats():
+    await run_periodic(
+        "update_checkpoint_stats", STATS_REFRESH_TTL, update_checkpoint_stats_once, "Ошибка при обновлении статистики КПП: %s",
+        # Новый лидер начинает с полного прохода, даже если уже был лидером раньше
+        on_acquire=_dirty_checkpoints.reset
+    )
 
-                await session.commit()
 
-        except Exception as e:
-            logger.exception("Ошибка при очистке устаревших данных: %s", e)
+async def update_forecasts():
+    await run_periodic(FORECAST_JOB, FORECAST_REFRESH_INTERVAL, update_forecasts_once, "Ошибка при обновлении прогноза КПП: %s")
 
-        await asyncio.sleep(CLEANUP_INTERVAL)
 
+async def detect_crossings():
+    await run_periodic(CROSSINGS_JOB, CROSSING_REFRESH_INTERVAL, detect_crossings_once, "Ошибка при разметке пингов: %s")
 
-async def update_checkpoint_stats():
-    while True:
-        try:
-            async with AsyncSessionLocal() as session:
-                grouped_reports = await fetch_recent_reports(session)
-                now = datetime.now(timezone.utc)
-                updated_count = 0
-
-                for checkpoint_id, data in grouped_reports.items():
-                    stats = calculate_main_cluster_stats(data)
-                    if not stats:
-                        continue
-
-                    avg_wait, avg_queue = stats
-
-                    await session.execute(
-                        update(Checkpoint)
-                        .where(Checkpoint.id == checkpoint_id)
-                        .values(
-                            avg_wait_time_hours=avg_wait,
-                            avg_queue_size=avg_queue,
-                            avg_updated_at=now
-                        )
-                    )
-
-                    logger.info(
-                        "[%s] Обновление КПП: %d записей, средняя задержка: %.2f ч, очередь: %d машин",
-                        checkpoint_id, len(data), avg_wait, avg_queue
-                    )
-                    updated_count += 1
-
-                await session.commit()
-                logger.info("Обновление статистики завершено: %d КПП", updated_count)
-
-        except Exception as e:
-            logger.exception("Ошибка при обновлении статистики КПП: %s", e)
-
-        await asyncio.sleep(STATS_REFRESH_TTL)
-
-
-async def fetch_recent_reports(session):
-    stmt = select(QueueReport)
-    result = await session.execute(stmt)
-    reports = result.scalars().all()
 
-    grouped = defaultdict(list)
-    for r in reports:
-        grouped[r.checkpoint_id].append((r.waiting_time_hours, r.throughput_vehicles_per_hour))
-    return grouped
+async def cleanup_old_data_once():
+    now = datetime.now(timezone.utc)
+
+    dropped, loc_rows = await cleanup_location_pings(now)
+    logger.info(
+        "Удалены старые координаты старше %s: %d секций, %d строк", now - LOCATION_ENTRY_TTL, dropped, loc_rows
+    )
+
+    queue_threshold = now - QUEUE_REPORT_TTL
+    queue_rows = await delete_in_batches(QueueReport, QueueReport.submitted_at < queue_threshold)
+    logger.info("Удалены старые опросы старше %s: %d строк", queue_threshold, queue_rows)
+
+    crossing_rows = await delete_in_batches(ObservedCrossing, ObservedCrossing.finished_at < queue_threshold)
+    logger.info("Удалены старые проезды по пингам старше %s: %d строк", queue_threshold, crossing_rows)
+
+    live_rows = await delete_in_batches(CheckpointLiveStats, CheckpointLiveStats.bucket_start < now - LIVE_STATS_WINDOW)
+    logger.info("Удалены устаревшие корзины оперативной статистики: %d строк", live_rows)
+
+    history_rows = await cleanup_history(now)
+    logger.info("Удалены устаревшие корзины истории статистики: %d строк", history_rows)
+
+    # Логи, на которые не ссылается ни один отзыв; свежие не трогаем, их отзыв может ещё коммититься
+    log_rows = await delete_in_batches(FeedbackLog, and_(
+        FeedbackLog.created_at < now - FEEDBACK_LOGS_ORPHAN_TTL,
+        ~exists().where(Feedback.logs_digest == FeedbackLog.digest)
+    ))
+    logger.info("Удалены логи без отзывов: %d строк", log_rows)
+
+
+async def update_forecasts_once():
+    # Тот же запас, что у водяного знака статистики: транзакции сброса буфера коммитятся не по порядку
+    until = datetime.now(timezone.utc) - STATS_WATERMARK_LAG
+    async with AsyncSessionLocal() as session:
+        updated = await apply_new_reports(session, until)
+        await session.commit()
+
+    logger.info("Обновление прогноза завершено: %d КПП", updated)
+    if updated:
+        await refresh_snapshot()
+
+
+async def detect_crossings_once():
+    # Пинги тоже пишутся через буфер, поэтому разметка отстаёт на тот же запас
+    await process_new_pings(datetime.now(timezone.utc) - STATS_WATERMARK_LAG)
+
+
+class DirtyCheckpoints:
+    """Отбор КПП, статистику которых нужно пересчитать.
+
+    КПП грязный, если после прошлого прохода у него появился опрос (inserted_at новее
+    водяного знака) или проезд по пингам (recorded_at новее водяного знака), или истёк самый
+    старый из учтённых опросов. Сравнивается время записи в БД, а не submitted_at: буфер после
+    сбоя сброса дописывает опросы с давним submitted_at. Водяной знак отстаёт от начала прохода
+    на STATS_WATERMARK_LAG — на время транзакций сброса и расхождение часов приложения и БД.
+    Состояние живёт в процессе лидера и сбрасывается при каждом получении лидерства (reset),
+    поэтому новый лидер — в том числе вернувший себе лидерство — начинает с полного прохода.
+    """
+
+    def __init__(self):
+        self.watermark: datetime | None = None
+        self.expires_at: dict[int, datetime] = {}
+
+    def reset(self):
+        """Следующий проход будет полным."""
+        self.watermark = None
+        self.expires_at.clear()
+
+    async def collect(self, session, now: datetime) -> set[int] | None:
+        """Грязные КПП или None, если нужен полный пересчёт."""
+        if self.watermark is None:
+            return None
+
+        result = await session.execute(
+            select(QueueReport.checkpoint_id).where(QueueReport.inserted_at > self.watermark).distinct()
+        )
+        dirty = set(result.scalars().all())
+        result = await session.execute(
+            select(ObservedCrossing.checkpoint_id).where(ObservedCrossing.recorded_at > self.watermark).distinct()
+        )
+        dirty.update(result.scalars().all())
+        dirty.update(cp_id for cp_id, expires_at in self.expires_at.items() if expires_at <= now)
+        return dirty
 
+    def mark(self, grouped: dict[int, list], dirty: set[int] | None, started_at: datetime):
+        if dirty is None:
+            self.expires_at.clear()
+        for cp_id in dirty or ():
+            self.expires_at.pop(cp_id, None)
+        for cp_id, data in grouped.items():
+            self.expires_at[cp_id] = min(submitted_at for _, _, submitted_at in data) + QUEUE_REPORT_TTL
+        self.watermark = started_at - STATS_WATERMARK_LAG
 
-def calculate_main_cluster_stats(data: list[tuple[float, int]]) -> tuple[float, float] | None:
-    if len(data) < 5:
-        return None
 
-    df = pd.DataFrame(data, columns=["waiting_time_hours", "throughput"])
+_dirty_checkpoints = DirtyCheckpoints()
 
-    try:
-        X = df[["waiting_time_hours"]].to_numpy()
-        kmeans = KMeans(n_clusters=2, random_state=42, n_init=10)
-        labels = kmeans.fit_predict(X)
 
-        main_cluster = pd.Series(labels).value_counts().idxmax()
-        filtered = df[labels == main_cluster]
+async def update_checkpoint_stats_once(full: bool = False):
+    """Пересчитывает статистику грязных КПП; full=True — всех КПП, как первый проход лидера."""
+    # numpy грузится при первом расчёте, а не при импорте app.main
+    from app.analytics import compute_cluster_stats
 
-        avg_wait = filtered["waiting_time_hours"].mean()
-        avg_queue = (filtered["waiting_time_hours"] * filtered["throughput"]).mean()
-        return round(avg_wait, 2), round(avg_queue)
-    except Exception as e:
-        logger.warning("Ошибка кластеризации: %s", e)
-        return None
+    if full:
+        _dirty_checkpoints.reset()
+
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        dirty = await _dirty_checkpoints.collect(session, now)
+        grouped_reports = await fetch_recent_reports(session, now, dirty)
+
+    # Транзакция чтения закрыта до расчёта, запись — отдельной короткой транзакцией
+    stats = await compute_cluster_stats(grouped_reports)
+    async with AsyncSessionLocal() as session:
+        changed = await write_checkpoint_stats(session, stats, now)
+        changed += await mark_stale_checkpoints(session, stats, dirty, now)
+        await record_stats(session, stats, now)
+        await session.commit()
+
+    _dirty_checkpoints.mark(grouped_reports, dirty, now)
+    logger.info(
+        "Обновление статистики завершено: %s, рассчитано %d КПП, изменилось %d",
+        "полный пересчёт" if dirty is None else f"затронуто {len(dirty)} КПП", len(stats), len(changed)
+    )
+    if changed:
+        logger.debug(
+            "Новая статистика КПП: %s",
+            ", ".join(
+                f"{cp_id}: {stats[cp_id][0]:.2f} ч / {stats[cp_id][1]} машин" if cp_id in stats else f"{cp_id}: прогноз"
+                for cp_id in changed
+            )
+        )
+        # Остальные воркеры подхватят изменения через watch_snapshot
+        await refresh_snapshot()
+
+
+async def write_checkpoint_stats(session, stats: dict[int, tuple[float, int]], now: datetime) -> list[int]:
+    """UPDATE ... FROM (VALUES ...) по STATS_WRITE_CHUNK строк записывает статистику КПП, где она изменилась.
+
+    Строки с прежними значениями не трогаются: нет лишних версий строк, а avg_updated_at
+    отражает время последнего изменения статистики. Возвращает id изменённых КПП.
+    """
+    if not stats:
+        return []
+
+    rows = [(cp_id, avg_wait, avg_queue) for cp_id, (avg_wait, avg_queue) in stats.items()]
+    changed = []
+    for offset in range(0, len(rows), STATS_WRITE_CHUNK):
+        refreshed = values(
+            column("id", Integer), column("avg_wait", Float), column("avg_queue", Integer), name="refreshed"
+        ).data(rows[offset:offset + STATS_WRITE_CHUNK])
+
+        result = await session.execute(
+            update(Checkpoint)
+            .where(Checkpoint.id == refreshed.c.id)
+            .where(or_(
+                Checkpoint.avg_wait_time_hours.is_distinct_from(refreshed.c.avg_wait),
+                Checkpoint.avg_queue_size.is_distinct_from(refreshed.c.avg_queue),
+                Checkpoint.stats_fresh.is_(False),
+            ))
+            .values(
+                avg_wait_time_hours=refreshed.c.avg_wait,
+                avg_queue_size=refreshed.c.avg_queue,
+                avg_updated_at=now,
+                stats_fresh=True
+            )
+            .returning(Checkpoint.id)
+        )
+        changed.extend(result.scalars().all())
+    return changed
+
+
+async def mark_stale_checkpoints(session, stats: dict[int, tuple[float, int]], dirty: set[int] | None, now: datetime) -> list[int]:
+    """Снимает stats_fresh с пересмотренных КПП, у которых не хватило свежих опросов.
+
+    Их статистика не перезаписывается, а в списках вместо неё показывается прогноз.
+    """
+    stmt = update(Checkpoint).where(Checkpoint.stats_fresh.is_(True))
+    if dirty is None:
+        stmt = stmt.where(Checkpoint.id.not_in(stats.keys()))
+    else:
+        stale = dirty.difference(stats)
+        if not stale:
+            return []
+        stmt = stmt.where(Checkpoint.id.in_(stale))
+
+    result = await session.execute(stmt.values(stats_fresh=False, avg_updated_at=now).returning(Checkpoint.id))
+    return list(result.scalars().all())
+
+
+async def fetch_recent_reports(session, now: datetime, checkpoint_ids: set[int] | None = None):
+    """Опросы за QUEUE_REPORT_TTL кортежами (ожидание, пропускная способность, время) по КПП.
+
+    Проезды, размеченные по пингам, добавляются как опросы без пропускной способности (NaN).
+    checkpoint_ids=None — все КПП.
+    """
+    grouped = defaultdict(list)
+    if checkpoint_ids is not None and not checkpoint_ids:
+        return grouped
+
+    stmt = select(
+        QueueReport.checkpoint_id,
+        QueueReport.waiting_time_hours,
+        QueueReport.throughput_vehicles_per_hour,
+        QueueReport.submitted_at,
+    ).where(QueueReport.submitted_at >= now - QUEUE_REPORT_TTL)
+    if checkpoint_ids is not None:
+        stmt = stmt.where(QueueReport.checkpoint_id.in_(checkpoint_ids))
+
+    result = await session.execute(stmt.execution_options(query_name="recent_reports"))
+    for checkpoint_id, wait, throughput, submitted_at in result:
+        grouped[checkpoint_id].append((wait, throughput, submitted_at))
+
+    stmt = select(
+        ObservedCrossing.checkpoint_id,
+        ObservedCrossing.wait_hours,
+        ObservedCrossing.finished_at,
+    ).where(ObservedCrossing.finished_at >= now - QUEUE_REPORT_TTL)
+    if checkpoint_ids is not None:
+        stmt = stmt.where(ObservedCrossing.checkpoint_id.in_(checkpoint_ids))
+
+    result = await session.execute(stmt)
+    for checkpoint_id, wait, finished_at in result:
+        grouped[checkpoint_id].append((wait, float("nan"), finished_at))
+    return grouped
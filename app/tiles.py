@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import math
+import time
+from pydantic import TypeAdapter
+from app.http_cache import CachedBody, make_etag
+from app.schemas import TileClusterOut
+from app.settings import TILE_MAX_ZOOM, TILE_CLUSTER_GRID_BITS
+from app.snapshot import CheckpointSnapshot, on_snapshot
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+MAX_MERCATOR_LAT = 85.05112878
+
+_cluster_list_adapter = TypeAdapter(list[TileClusterOut])
+EMPTY_TILE = CachedBody(b"[]")
+
+
+class TileIndex:
+    """Кластеры КПП, заранее посчитанные для всех тайлов с z <= TILE_MAX_ZOOM.
+
+    Внутри тайла точки группируются по сетке 2^TILE_CLUSTER_GRID_BITS x 2^TILE_CLUSTER_GRID_BITS,
+    так что размер ответа ограничен тайлом, а не количеством КПП в нём.
+    Индекс строится в отдельном потоке; версия тайлов — хэш координат и ожиданий,
+    поэтому ETag одинаковы у всех воркеров и не меняются, пока не изменились сами тайлы.
+    """
+
+    def __init__(self, snapshot: CheckpointSnapshot, content: bytes):
+        self.snapshot = snapshot
+        self.content = content
+        self.version = hashlib.blake2b(content, digest_size=8).hexdigest()
+        self.tiles: dict[tuple[int, int, int], CachedBody] = {}
+
+        xs = []
+        ys = []
+        for pos in range(len(snapshot)):
+            x, y = mercator(snapshot.lat[pos], snapshot.lon[pos])
+            xs.append(x)
+            ys.append(y)
+
+        for z in range(TILE_MAX_ZOOM + 1):
+            scale = 1 << (z + TILE_CLUSTER_GRID_BITS)
+            cells: dict[tuple[int, int], list[int]] = {}
+            for pos in range(len(snapshot)):
+                cell = (min(int(xs[pos] * scale), scale - 1), min(int(ys[pos] * scale), scale - 1))
+                cells.setdefault(cell, []).append(pos)
+
+            tiles: dict[tuple[int, int], list[TileClusterOut]] = {}
+            for (cx, cy), positions in cells.items():
+                tile = (cx >> TILE_CLUSTER_GRID_BITS, cy >> TILE_CLUSTER_GRID_BITS)
+                tiles.setdefault(tile, []).append(cluster_out(snapshot, positions))
+
+            for (x, y), clusters in tiles.items():
+                self.tiles[(z, x, y)] = CachedBody(_cluster_list_adapter.dump_json(clusters))
+
+    def body(self, z: int, x: int, y: int) -> CachedBody:
+        if z <= TILE_MAX_ZOOM:
+            return self.tiles.get((z, x, y), EMPTY_TILE)
+        # На крупных масштабах в тайле мало КПП, кластеризация не нужна
+        min_lat, max_lat, min_lon, max_lon = tile_bounds(z, x, y)
+        positions = self.snapshot.query_bbox(min_lat, max_lat, min_lon, max_lon)
+        return CachedBody(_cluster_list_adapter.dump_json([cluster_out(self.snapshot, [pos]) for pos in positions]))
+
+    def etag(self, z: int, x: int, y: int) -> str:
+        return make_etag(self.version, z, x, y)
+
+
+def cluster_out(snapshot: CheckpointSnapshot, positions: list[int]) -> TileClusterOut:
+    count = len(positions)
+    waits = [snapshot.wait[pos] for pos in positions]
+    return TileClusterOut(
+        count=count,
+        latitude=sum(snapshot.lat[pos] for pos in positions) / count,
+        longitude=sum(snapshot.lon[pos] for pos in positions) / count,
+        maxWaitTimeHours=max(waits),
+        avgWaitTimeHours=round(sum(waits) / count, 2),
+        checkpointId=snapshot.ids[positions[0]] if count == 1 else None
+    )
+
+
+def tile_content(snapshot: CheckpointSnapshot) -> bytes:
+    """Всё, от чего зависят тайлы: id, координаты и ожидание КПП."""
+    return snapshot.ids.tobytes() + snapshot.lat.tobytes() + snapshot.lon.tobytes() + snapshot.wait.tobytes()
+
+
+def mercator(lat: float, lon: float) -> tuple[float, float]:
+    """Нормированные координаты Web Mercator в [0, 1), y растёт к югу."""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    n = 1 << z
+
+    def lat_at(ty: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return lat_at(y + 1), lat_at(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+_index: TileIndex | None = None
+_pending: CheckpointSnapshot | None = None
+_task: asyncio.Task | None = None
+
+
+@on_snapshot
+def schedule_tiles(snapshot: CheckpointSnapshot, previous: CheckpointSnapshot | None):
+    """Ставит перестройку тайлов в фон; до её завершения отдаются прежние тайлы."""
+    global _pending, _task
+    _pending = snapshot
+    if _task is None or _task.done():
+        _task = asyncio.create_task(rebuild_tiles())
+
+
+async def rebuild_tiles():
+    global _index, _pending
+    # Снимки, пришедшие во время сборки, схлопываются в последний
+    while _pending is not None:
+        snapshot, _pending = _pending, None
+        content = tile_content(snapshot)
+        if _index is not None and _index.content == content:
+            continue
+
+        started = time.perf_counter()
+        try:
+            index = await asyncio.to_thread(TileIndex, snapshot, content)
+        except Exception as e:
+            logger.exception("Ошибка построения тайлов кластеров: %s", e)
+            continue
+        # Замена ссылки атомарна: запрос видит либо старый, либо новый индекс целиком
+        _index = index
+        logger.info(
+            "Тайлы кластеров перестроены: %d непустых тайлов (z <= %d) за %.1f мс",
+            len(index.tiles), TILE_MAX_ZOOM, (time.perf_counter() - started) * 1000
+        )
+
+
+async def get_tile_index() -> TileIndex | None:
+    if _index is None and _task is not None:
+        # Первая сборка после старта: дождаться её, не отменяя при обрыве запроса
+        await asyncio.shield(_task)
+    return _index
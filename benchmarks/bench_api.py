@@ -0,0 +1,166 @@
+"""Нагрузка на эндпоинты API внутри процесса через httpx.ASGITransport.
+
+Приложение запускается без lifespan: миграции и фоновые задачи не нужны, снимок КПП
+строится явно, буферы приёма работают как в рабочем процессе.
+"""
+import asyncio
+import itertools
+import math
+import random
+import time
+from collections import Counter
+from typing import Callable
+from benchmarks.timing import summarize
+
+
+def encode_polyline(points: list[tuple[float, float]], precision: int = 5) -> str:
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = round(lat * factor), round(lon * factor)
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def tile_of(lat: float, lon: float, z: int) -> tuple[int, int]:
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(x, n - 1), min(max(y, 0), n - 1)
+
+
+def build_scenarios(checkpoints: list[tuple[int, float, float]], proposal_ids: list[str], seed: int) -> dict[str, Callable[[], tuple]]:
+    """Сценарий — функция, возвращающая (метод, путь, тело JSON, заголовки) очередного запроса."""
+    rng = random.Random(seed)
+    devices = itertools.count()
+
+    def checkpoint():
+        return rng.choice(checkpoints)
+
+    def bbox(size: float = 2.0) -> str:
+        _, lat, lon = checkpoint()
+        return f"min_lat={lat - size / 2}&max_lat={lat + size / 2}&min_lon={lon - size / 2}&max_lon={lon + size / 2}"
+
+    def route() -> str:
+        _, lat, lon = checkpoint()
+        return encode_polyline([(lat + i * 0.2, lon + i * 0.3) for i in range(-3, 4)])
+
+    def tile() -> str:
+        _, lat, lon = checkpoint()
+        x, y = tile_of(lat, lon, 6)
+        return f"/tiles/6/{x}/{y}"
+
+    def location_point() -> dict:
+        cp_id, lat, lon = checkpoint()
+        return {"device_id": f"bench-api-{next(devices)}", "latitude": lat, "longitude": lon, "checkpoint_id": cp_id}
+
+    def queue_report() -> dict:
+        cp_id, lat, lon = checkpoint()
+        return {
+            "checkpoint_id": cp_id, "lat": lat, "lon": lon,
+            "waiting_time_hours": round(rng.uniform(0.5, 10), 2),
+            "throughput_vehicles_per_hour": rng.randint(5, 120),
+            "device_id": f"bench-api-{next(devices)}",
+        }
+
+    scenarios = {
+        "GET /checkpoints": lambda: ("GET", f"/checkpoints?{bbox()}", None, {}),
+        "GET /checkpoints columnar": lambda: (
+            "GET", f"/checkpoints?{bbox()}&layout=columnar&fields=id,latitude,longitude,waitTimeHours", None, {}
+        ),
+        "GET /checkpoints msgpack": lambda: ("GET", f"/checkpoints?{bbox()}", None, {"Accept": "application/msgpack"}),
+        "GET /checkpoints ndjson": lambda: ("GET", f"/checkpoints?{bbox()}", None, {"Accept": "application/x-ndjson"}),
+        "GET /checkpoints/{id}": lambda: ("GET", f"/checkpoints/{checkpoint()[0]}", None, {}),
+        "GET /checkpoints/nearest": lambda: (
+            "GET", "/checkpoints/nearest?lat={1}&lon={2}&k=10".format(*checkpoint()), None, {}
+        ),
+        "POST /checkpoints/corridor": lambda: ("POST", "/checkpoints/corridor", {"polyline": route(), "width_km": 10}, {}),
+        "GET /tiles/{z}/{x}/{y}": lambda: ("GET", tile(), None, {}),
+        "GET /checkpoints/{id}/history": lambda: ("GET", f"/checkpoints/{checkpoint()[0]}/history", None, {}),
+        "GET /checkpoints/{id}/forecast": lambda: ("GET", f"/checkpoints/{checkpoint()[0]}/forecast", None, {}),
+        "POST /queue_report": lambda: ("POST", "/queue_report", queue_report(), {}),
+        "POST /location": lambda: ("POST", "/location", location_point(), {}),
+        "POST /location/batch": lambda: ("POST", "/location/batch", {"points": [location_point() for _ in range(50)]}, {}),
+        "GET /jobs": lambda: ("GET", "/jobs", None, {}),
+    }
+    if proposal_ids:
+        scenarios["GET /proposals"] = lambda: ("GET", "/proposals", None, {})
+        scenarios["POST /proposals/{id}/vote"] = lambda: (
+            "POST", f"/proposals/{rng.choice(proposal_ids)}/vote",
+            {"device_id": f"bench-api-{next(devices)}", "vote": rng.random() < 0.5}, {}
+        )
+    return scenarios
+
+
+async def run_scenario(client, build: Callable[[], tuple], requests: int, concurrency: int, warmup: int) -> dict:
+    async def send(record: bool):
+        method, url, body, headers = build()
+        started = time.perf_counter()
+        response = await client.request(method, url, json=body, headers=headers)
+        await response.aread()
+        if record:
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    for _ in range(warmup):
+        await send(False)
+
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            await send(True)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return {**summarize(latencies, wall), "status": {str(code): n for code, n in sorted(statuses.items())}}
+
+
+async def bench_api(requests: int, concurrency: int, warmup: int, only: list[str] | None = None, seed: int = 42) -> dict:
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("Для бенчмарка API нужен httpx: pip install -r requirements-dev.txt")
+
+    from sqlalchemy import select
+    from app.db import AsyncSessionLocal
+    from app.ingest import location_buffer, queue_report_buffer
+    from app.main import app
+    from app.models import Checkpoint, Proposal
+    from app.snapshot import refresh_snapshot
+
+    async with AsyncSessionLocal() as session:
+        checkpoints = (await session.execute(select(Checkpoint.id, Checkpoint.lat, Checkpoint.lon))).all()
+        proposal_ids = [str(p) for p in (await session.execute(select(Proposal.id))).scalars().all()]
+    if not checkpoints:
+        raise SystemExit("В базе нет КПП: сначала наполните её (--seed-db)")
+
+    await refresh_snapshot()
+    location_buffer.start()
+    queue_report_buffer.start()
+
+    scenarios = build_scenarios([tuple(row) for row in checkpoints], proposal_ids, seed)
+    results = {}
+    try:
+        # https: приложение перенаправляет http-запросы через HTTPSRedirectMiddleware
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="https://bench") as client:
+            for name, build in scenarios.items():
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                results[name] = await run_scenario(client, build, requests, concurrency, warmup)
+    finally:
+        await location_buffer.stop()
+        await queue_report_buffer.stop()
+    results["ingest"] = {buffer.name: buffer.stats() for buffer in (location_buffer, queue_report_buffer)}
+    return results
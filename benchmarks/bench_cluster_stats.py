@@ -0,0 +1,112 @@
+"""Сравнение точного 2-means (app.analytics) с прежним расчётом через pandas + KMeans.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_cluster_stats --checkpoints 500 --max-reports 300
+
+Печатает время обоих вариантов и расхождения результатов по категориям:
+- tie      — кластеры равного размера, KMeans выбирает основной произвольно;
+- local    — KMeans сошёлся в локальный минимум (инерция выше точного разреза);
+- rounding — разбиение то же, среднее отличается на 0.01 из-за порядка суммирования на x.xx5.
+"""
+import argparse
+import random
+import time
+import warnings
+
+
+def kmeans_stats(data: list[tuple[float, int]]):
+    """Прежняя реализация calculate_main_cluster_stats."""
+    import pandas as pd
+    from sklearn.cluster import KMeans
+
+    if len(data) < 5:
+        return None
+    df = pd.DataFrame(data, columns=["waiting_time_hours", "throughput"])
+    X = df[["waiting_time_hours"]].to_numpy()
+    kmeans = KMeans(n_clusters=2, random_state=42, n_init=10)
+    labels = kmeans.fit_predict(X)
+
+    main_cluster = pd.Series(labels).value_counts().idxmax()
+    filtered = df[labels == main_cluster]
+    avg_wait = filtered["waiting_time_hours"].mean()
+    avg_queue = (filtered["waiting_time_hours"] * filtered["throughput"]).mean()
+    return (round(avg_wait, 2), round(avg_queue)), labels, kmeans.inertia_
+
+
+def generate(checkpoints: int, max_reports: int, seed: int) -> dict[int, list[tuple[float, int]]]:
+    rng = random.Random(seed)
+    grouped = {}
+    for cp_id in range(checkpoints):
+        rows = []
+        fast, slow = rng.uniform(0.5, 4), rng.uniform(6, 20)
+        share = rng.uniform(0.5, 0.9)
+        for _ in range(rng.randint(1, max_reports)):
+            center = fast if rng.random() < share else slow
+            rows.append((round(abs(rng.gauss(center, center * 0.3)), 2), rng.randint(5, 120)))
+        grouped[cp_id] = rows
+    return grouped
+
+
+def optimal_inertia(values) -> float:
+    import numpy as np
+
+    xs = np.sort(np.asarray(values, dtype=float))
+    best = np.inf
+    for k in range(1, len(xs)):
+        left, right = xs[:k], xs[k:]
+        best = min(best, ((left - left.mean()) ** 2).sum() + ((right - right.mean()) ** 2).sum())
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkpoints", type=int, default=500)
+    parser.add_argument("--max-reports", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from app.analytics import grouped_cluster_stats
+
+    warnings.filterwarnings("ignore")
+    grouped = generate(args.checkpoints, args.max_reports, args.seed)
+    reports = sum(len(rows) for rows in grouped.values())
+
+    started = time.perf_counter()
+    reference = {cp_id: kmeans_stats(rows) for cp_id, rows in grouped.items()}
+    kmeans_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    exact = grouped_cluster_stats(grouped)
+    exact_seconds = time.perf_counter() - started
+
+    mismatches = {"tie": 0, "local": 0, "rounding": 0, "other": 0}
+    for cp_id, rows in grouped.items():
+        ref = reference[cp_id]
+        if ref is None:
+            if cp_id in exact:
+                mismatches["other"] += 1
+            continue
+        (ref_wait, ref_queue), labels, inertia = ref
+        wait, queue = exact[cp_id]
+        if abs(ref_wait - wait) < 1e-9 and ref_queue == queue:
+            continue
+
+        sizes = sorted((labels == label).sum() for label in set(labels))
+        if inertia > optimal_inertia([row[0] for row in rows]) + 1e-9:
+            mismatches["local"] += 1
+        elif len(sizes) == 2 and sizes[0] == sizes[1]:
+            mismatches["tie"] += 1
+        elif abs(ref_wait - wait) <= 0.01 + 1e-9 and abs(ref_queue - queue) <= 1:
+            mismatches["rounding"] += 1
+        else:
+            mismatches["other"] += 1
+
+    print(f"КПП: {args.checkpoints}, опросов: {reports}")
+    print(f"pandas + KMeans: {kmeans_seconds * 1000:10.1f} мс")
+    print(f"точный 2-means:  {exact_seconds * 1000:10.1f} мс  (x{kmeans_seconds / exact_seconds:.0f})")
+    print("расхождения:", ", ".join(f"{name}={count}" for name, count in mismatches.items()))
+
+
+if __name__ == "__main__":
+    main()
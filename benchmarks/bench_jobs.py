@@ -0,0 +1,57 @@
+"""Микробенчмарки горячих путей фоновых задач на наполненной базе."""
+import random
+import time
+from datetime import datetime, timezone
+from benchmarks.timing import measure, summarize
+
+
+async def bench_jobs(repeat: int, seed: int = 42) -> dict:
+    from sqlalchemy import select
+    from app import tasks
+    from app.analytics import grouped_cluster_stats
+    from app.db import AsyncSessionLocal
+    from app.models import Checkpoint
+    from benchmarks.bench_cluster_stats import generate
+
+    results = {}
+
+    # Расчёт кластеров (замена прежнего calculate_main_cluster_stats) без БД
+    grouped = generate(checkpoints=1000, max_reports=300, seed=seed)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        grouped_cluster_stats(grouped)
+        samples.append(time.perf_counter() - started)
+    results["grouped_cluster_stats"] = {
+        **summarize(samples),
+        "checkpoints": len(grouped),
+        "reports": sum(len(rows) for rows in grouped.values()),
+    }
+
+    async with AsyncSessionLocal() as session:
+        checkpoint_ids = list((await session.execute(select(Checkpoint.id))).scalars().all())
+    rng = random.Random(seed)
+    dirty = set(rng.sample(checkpoint_ids, max(len(checkpoint_ids) // 20, 1))) if checkpoint_ids else set()
+
+    async def fetch(ids):
+        async with AsyncSessionLocal() as session:
+            return await tasks.fetch_recent_reports(session, datetime.now(timezone.utc), ids)
+
+    results["fetch_recent_reports"] = summarize(await measure(lambda: fetch(None), repeat))
+    results["fetch_recent_reports_dirty_5pct"] = {**summarize(await measure(lambda: fetch(dirty), repeat)), "checkpoints": len(dirty)}
+
+    results["update_checkpoint_stats_full"] = summarize(
+        await measure(lambda: tasks.update_checkpoint_stats_once(full=True), repeat)
+    )
+    results["update_checkpoint_stats_incremental"] = summarize(await measure(tasks.update_checkpoint_stats_once, repeat))
+
+    # Прогнозы нужны и для GET /checkpoints/{id}/forecast в бенчмарке API
+    results["update_forecasts_first_ms"] = round((await measure(tasks.update_forecasts_once, 1))[0] * 1000, 3)
+
+    # Первый проход очистки удаляет устаревшую часть синтетических данных, следующие — холостые
+    first = await measure(tasks.cleanup_old_data_once, 1)
+    results["cleanup_old_data"] = {
+        "first_ms": round(first[0] * 1000, 3),
+        "idle": summarize(await measure(tasks.cleanup_old_data_once, repeat)),
+    }
+    return results
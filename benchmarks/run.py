@@ -0,0 +1,114 @@
+"""Воспроизводимый прогон бенчмарков: наполнение базы, фоновые задачи и эндпоинты API.
+
+Запуск из корня репозитория на отдельной базе (таблицы пересоздаются!):
+
+    DB_NAME=gatemap_bench python -m benchmarks.run --seed-db --checkpoints 2000 --output bench.json
+
+Результат — JSON с коммитом, объёмом данных, сводками задач и по каждому эндпоинту
+(пропускная способность, p50/p99 в мс, коды ответов). Два таких файла от разных
+коммитов сравниваются построчно.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def git_revision() -> dict:
+    def git(*args) -> str | None:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+async def run(args) -> dict:
+    from app.config import DB_NAME
+    from app.db import engine
+    from app.stats_pool import shutdown_pool
+    from benchmarks.bench_api import bench_api
+    from benchmarks.bench_jobs import bench_jobs
+    from benchmarks.seed import Scale, seed_database
+
+    # Журнал SQL (echo) заметно искажает время ответа
+    engine.echo = False
+
+    report = {
+        **git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": DB_NAME,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+
+    try:
+        if args.seed_db:
+            if "bench" not in DB_NAME and not args.force:
+                raise SystemExit(f"База {DB_NAME!r} будет пересоздана; для баз без 'bench' в имени нужен --force")
+            scale = Scale(
+                checkpoints=args.checkpoints,
+                reports_per_checkpoint=args.reports_per_checkpoint,
+                pings=args.pings,
+                proposals=args.proposals,
+                votes_per_proposal=args.votes_per_proposal,
+                expired_share=args.expired_share,
+                seed=args.seed,
+            )
+            report["scale"] = scale.as_dict()
+            report["seeded"] = await seed_database(scale)
+
+        if not args.skip_jobs:
+            report["jobs"] = await bench_jobs(args.repeat, args.seed)
+        if not args.skip_api:
+            report["api"] = await bench_api(args.requests, args.concurrency, args.warmup, args.only, args.seed)
+    finally:
+        shutdown_pool()
+        await engine.dispose()
+
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed-db", action="store_true", help="Пересоздать схему и наполнить базу")
+    parser.add_argument("--force", action="store_true", help="Разрешить пересоздание базы без 'bench' в имени")
+    parser.add_argument("--checkpoints", type=int, default=1000)
+    parser.add_argument("--reports-per-checkpoint", type=int, default=20)
+    parser.add_argument("--pings", type=int, default=100_000)
+    parser.add_argument("--proposals", type=int, default=20)
+    parser.add_argument("--votes-per-proposal", type=int, default=200)
+    parser.add_argument("--expired-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="Запросов на эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов каждого микробенчмарка")
+    parser.add_argument("--only", nargs="*", help="Подстроки имён эндпоинтов, например '/checkpoints' 'POST'")
+    parser.add_argument("--skip-jobs", action="store_true")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", help="Файл для JSON; по умолчанию stdout")
+    args = parser.parse_args()
+
+    # Раньше app.main: его basicConfig на INFO тогда не сработает, в выводе останется только результат
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s", stream=sys.stderr)
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
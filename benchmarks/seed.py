@@ -0,0 +1,158 @@
+"""Наполнение отдельной базы синтетическими КПП, опросами, пингами и голосами для бенчмарков.
+
+Схема создаётся заново по моделям (drop_all + create_all), location_pings — с секциями
+по часам, как в рабочей базе. Часть опросов и пингов (expired_share) кладётся старше
+TTL, чтобы задаче очистки было что удалять.
+"""
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert
+from app.db import engine
+from app.ingest import LocationPingBuffer
+from app.models import Base, Checkpoint, QueueReport, Proposal, ProposalVote
+from app.retention import LOCATION_PARTITION_INTERVAL, _create_partition, ensure_partitions, partition_start
+from app.settings import LOCATION_ENTRY_TTL, QUEUE_REPORT_TTL
+
+COUNTRIES = ("PL", "BY", "LT", "LV", "EE", "RU", "UA", "FI", "RO", "MD")
+INSERT_CHUNK = 5000
+
+
+class Scale:
+    """Объём синтетических данных."""
+
+    __slots__ = ("checkpoints", "reports_per_checkpoint", "pings", "proposals", "votes_per_proposal", "expired_share", "seed")
+
+    def __init__(
+        self,
+        checkpoints: int = 1000,
+        reports_per_checkpoint: int = 20,
+        pings: int = 100_000,
+        proposals: int = 20,
+        votes_per_proposal: int = 200,
+        expired_share: float = 0.2,
+        seed: int = 42,
+    ):
+        self.checkpoints = checkpoints
+        self.reports_per_checkpoint = reports_per_checkpoint
+        self.pings = pings
+        self.proposals = proposals
+        self.votes_per_proposal = votes_per_proposal
+        self.expired_share = expired_share
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _age(rng: random.Random, ttl: timedelta, expired_share: float) -> timedelta:
+    if rng.random() < expired_share:
+        return ttl + timedelta(hours=rng.uniform(0, 6))
+    return ttl * rng.random()
+
+
+async def _insert(conn, model, rows: list[dict]):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        await conn.execute(insert(model), rows[start:start + INSERT_CHUNK])
+
+
+async def seed_database(scale: Scale) -> dict[str, int]:
+    """Пересоздаёт схему и заполняет её; возвращает число строк по таблицам."""
+    rng = random.Random(scale.seed)
+    now = datetime.now(timezone.utc)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+        # Секции пингов: от самого старого синтетического пинга до текущего часа
+        start = partition_start(now - LOCATION_ENTRY_TTL - timedelta(hours=6))
+        while start <= partition_start(now):
+            await _create_partition(conn, start)
+            start += LOCATION_PARTITION_INTERVAL
+    await ensure_partitions(now)
+
+    checkpoints = []
+    for i in range(scale.checkpoints):
+        country_from, country_to = rng.sample(COUNTRIES, 2)
+        checkpoints.append({
+            "id": i + 1,
+            "name": f"КПП {i + 1}",
+            "lat": rng.uniform(41.0, 60.0),
+            "lon": rng.uniform(14.0, 40.0),
+            "country_from": country_from,
+            "country_to": country_to,
+            "avg_wait_time_hours": round(rng.uniform(0.5, 12.0), 2),
+            "avg_queue_size": rng.randint(0, 500),
+            "avg_updated_at": now,
+            "stats_fresh": True,
+        })
+
+    reports = []
+    for cp in checkpoints:
+        # Два режима очереди на КПП, как в bench_cluster_stats
+        fast, slow = rng.uniform(0.5, 4), rng.uniform(6, 20)
+        for j in range(rng.randint(0, 2 * scale.reports_per_checkpoint)):
+            center = fast if rng.random() < 0.7 else slow
+            submitted_at = now - _age(rng, QUEUE_REPORT_TTL, scale.expired_share)
+            reports.append({
+                "id": uuid.uuid4(),
+                "checkpoint_id": cp["id"],
+                "lat": cp["lat"],
+                "lon": cp["lon"],
+                "waiting_time_hours": round(abs(rng.gauss(center, center * 0.3)), 2),
+                "throughput_vehicles_per_hour": rng.randint(5, 120),
+                "device_id": f"bench-{cp['id']}-{j}",
+                "submitted_at": submitted_at,
+                # Как будто опросы записывались по мере поступления, а не все сейчас
+                "inserted_at": submitted_at,
+            })
+
+    proposals = [
+        {"id": uuid.uuid4(), "title": f"Предложение {i + 1}", "description": None, "created_at": now - timedelta(days=i)}
+        for i in range(scale.proposals)
+    ]
+    votes = [
+        {
+            "id": uuid.uuid4(),
+            "proposal_id": proposal["id"],
+            "device_id": f"bench-voter-{j}",
+            "vote": rng.random() < 0.7,
+            "voted_at": now,
+        }
+        for proposal in proposals
+        for j in range(scale.votes_per_proposal)
+    ]
+
+    async with engine.begin() as conn:
+        await _insert(conn, Checkpoint, checkpoints)
+        await _insert(conn, QueueReport, reports)
+        await _insert(conn, Proposal, proposals)
+        await _insert(conn, ProposalVote, votes)
+
+    # Пинги — через COPY тем же буфером, что и при приёме
+    devices = max(scale.pings // 50, 1)
+    pings = [
+        (
+            uuid.uuid4(),
+            f"bench-device-{rng.randrange(devices)}",
+            cp["lat"] + rng.uniform(-0.1, 0.1),
+            cp["lon"] + rng.uniform(-0.1, 0.1),
+            now - _age(rng, LOCATION_ENTRY_TTL, scale.expired_share),
+            cp["id"],
+        )
+        for cp in (rng.choice(checkpoints) for _ in range(scale.pings if checkpoints else 0))
+    ]
+    writer = LocationPingBuffer(max_rows=INSERT_CHUNK, flush_interval=1, max_pending=len(pings) + 1)
+    await writer.add(pings)
+    await writer.flush()
+    if writer.failed_flushes:
+        raise RuntimeError("Не удалось записать синтетические пинги")
+
+    return {
+        "checkpoints": len(checkpoints),
+        "queue_reports": len(reports),
+        "location_pings": len(pings),
+        "proposals": len(proposals),
+        "proposal_votes": len(votes),
+    }
@@ -0,0 +1,33 @@
+import time
+from typing import Awaitable, Callable
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(q * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples: list[float], wall: float | None = None) -> dict:
+    """Сводка по длительностям в секундах: число, пропускная способность, p50/p99 в мс."""
+    ordered = sorted(samples)
+    wall = wall if wall is not None else sum(samples)
+    return {
+        "count": len(ordered),
+        "throughput_per_s": round(len(ordered) / wall, 2) if wall else None,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+async def measure(func: Callable[[], Awaitable], repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return samples